@@ -1,110 +1,324 @@
 import logging
-from queue import Empty
+import queue
+import time
 from datetime import datetime
 from multiprocessing import Queue
-from typing import Optional
+from typing import Optional, Any
 from copy import deepcopy
 
-from deployer_utils import safe_delete_path
-from deployer_stages import DeploymentStatus, LogMessage, AbstractDeploymentStage
-from pipelines import all_stages, preset_pipelines
+from deployer_utils import safe_delete_path, check_dependency_cycles, get_model_fingerprint
+from deployer_journal import DeploymentJournal
+from deployer_logging import TaskLogWriter
+from deployer_metrics import DeployerMetrics
+from deployer_trace import make_trace, write_trace
+from deployer_executors import stage_executors, ProcessStageExecutor
+from deployer_polling import PROBE_WORKERS_NUM
+from deployer_stages import DeploymentStatus, LogMessage
+from pipelines import all_stages, preset_pipelines, dependency_gate_stages
 
 
 Logger = logging.getLoggerClass()
 
+default_stage_settings = {
+    'workers': 1,
+    'backend': 'process'
+}
+
 
 class Deployer:
     def __init__(self, config: dict):
         self.config: dict = config
         self.stages: dict = {}
+        self.in_queues: dict = {}
         self.current_task: Optional[dict] = None
+        self.pending_dependencies: dict = {}
+        self.pending_statuses: dict = {}
+        self.fingerprints: dict = {}
+        self.journal = DeploymentJournal(self.config['paths']['journal_dir'] / 'deployment_journal.jsonl')
+        self.out_queue: Optional[Queue] = None
+        # (full model name, stage class name, enqueue time, start time, end time, is failed) of processed stages
+        self.stage_timings: list = []
+        self.metrics = DeployerMetrics(self.config.get('metrics'))
+        # UTC timestamp of task log files names
+        self.task_timestamp: Optional[str] = None
+        self.task_dependencies: dict = {}
+        self.log_writer: Optional[TaskLogWriter] = None
+        self.failed_models: set = set()
 
-        for stage_class in all_stages:
-            in_queue = Queue()
-            out_queue = Queue()
-            stage_instance: AbstractDeploymentStage = stage_class(self.config, in_queue, out_queue)
-            stage_instance.start()
-            self.stages[stage_class.__name__] = stage_instance
+    def _start_stages(self, stage_classes: list, full_model_names: list) -> None:
+        """Starts workers of given stages, workers get config slice with only task models configs."""
+        worker_config = {key: value for key, value in self.config.items() if key not in ('models', 'model_groups')}
+        worker_config['models'] = {model: self.config['models'][model] for model in full_model_names}
 
-    def _setup_loggers(self, full_model_names: list) -> None:
-        self.config['paths']['log_dir'].mkdir(parents=True, exist_ok=True)
-        utc_timestamp_str = datetime.strftime(datetime.utcnow(), '%Y-%m-%d_%H-%M-%S_%f')
+        executor_classes = {}
+        # executors of the previous task are stopped, deployer can be reused
+        self.stages = {}
+        self.in_queues = {}
 
-        for full_model_name in full_model_names:
-            logger = logging.getLogger(full_model_name)
-            logger.setLevel(logging.DEBUG)
+        for stage_class in stage_classes:
+            backend = self._get_stage_settings(stage_class.__name__, 'backend')
+            if backend not in stage_executors.keys():
+                raise ValueError(f'Wrong backend for {stage_class.__name__}: {backend}, '
+                                 f'should be one of: {", ".join(stage_executors.keys())}')
+            executor_classes[stage_class] = stage_executors[backend]
+
+        # probes of all polling stages run in one process poller if stages are run in threads, so probe pool should
+        # be not smaller than total workers of such stages to not delay their probes
+        polling_workers_num = sum([self._get_stage_settings(stage_class.__name__, 'workers')
+                                   for stage_class in stage_classes if stage_class.uses_poller])
+        worker_config['probe_workers_num'] = max(polling_workers_num, PROBE_WORKERS_NUM)
+
+        # all stages report to the single shared queue, so coordinator can block on it until any result arrives,
+        # queue can be passed to other processes only if it is multiprocessing queue
+        is_multiprocess = any(executor_class is ProcessStageExecutor for executor_class in executor_classes.values())
+        self.out_queue = Queue() if is_multiprocess else queue.Queue()
+
+        # workers of one stage share its in_queue, so each item is taken by whichever worker is free, model can
+        # not get ahead of itself as it is passed to the next stage only after the current one returned it
+        for stage_class, executor_class in executor_classes.items():
+            stage_class_name = stage_class.__name__
+            in_queue = executor_class.queue_class()
+            self.in_queues[stage_class_name] = in_queue
+
+            workers_num = self._get_stage_settings(stage_class_name, 'workers')
+            if workers_num < 1:
+                raise ValueError(f'Wrong workers number for {stage_class_name}: {workers_num}, should be positive')
+
+            stages = [stage_class(worker_config, in_queue, self.out_queue) for _ in range(workers_num)]
+            self.stages[stage_class_name] = executor_class(stages, stage_class_name)
+
+        # processes are forked before threads of other stages are started
+        for stage_executor in sorted(self.stages.values(), key=lambda x: not isinstance(x, ProcessStageExecutor)):
+            stage_executor.start()
+
+    def _get_stage_settings(self, stage_class_name: str, setting_name: str) -> Any:
+        stages_config: dict = self.config.get('stages', {})
+        default_value = stages_config.get('default', {}).get(setting_name, default_stage_settings[setting_name])
+
+        return stages_config.get(stage_class_name, {}).get(setting_name, default_value)
+
+    def _setup_loggers(self, logger_names: list) -> None:
+        self.task_timestamp = datetime.strftime(datetime.utcnow(), '%Y-%m-%d_%H-%M-%S_%f')
+        self.log_writer = TaskLogWriter(self.config['paths']['log_dir'], self.task_timestamp, logger_names,
+                                        self.config.get('json_lines_logging', False))
+        self.log_writer.start()
+
+    def _teardown_loggers(self) -> None:
+        if self.log_writer is not None:
+            self.log_writer.stop()
+            self.log_writer = None
+
+    def _dispatch(self, deployment_status: DeploymentStatus) -> None:
+        next_stage_class_name = deployment_status.pipeline.pop(0).__name__
+        deployment_status.current_stage = next_stage_class_name
+        deployment_status.enqueue_time = time.time()
+        self.metrics.observe_dispatch(next_stage_class_name)
+        self.in_queues[next_stage_class_name].put(deployment_status)
+
+    def _export_metrics(self) -> None:
+        try:
+            self.metrics.export(self.in_queues)
+        except OSError as e:
+            logging.getLogger('_task_info').warning(f'Metrics export failed: {repr(e)}')
+
+    def _write_trace(self) -> None:
+        """Writes timeline of task stages next to the task info log."""
+        if self.task_timestamp is None or not self.stage_timings:
+            return
+
+        stage_workers = {name: len(stage_executor.stages) for name, stage_executor in self.stages.items()}
+        trace = make_trace(self.stage_timings, self.task_dependencies, stage_workers)
+        trace_path = self.config['paths']['log_dir'] / f'{self.task_timestamp}__task_info_trace.json'
+
+        try:
+            write_trace(trace_path, trace)
+        except OSError as e:
+            logging.getLogger('_task_info').warning(f'Trace writing failed: {repr(e)}')
+
+    def _release_dependents(self, full_model_name: str) -> None:
+        for dependent_model_name, dependencies in self.pending_dependencies.items():
+            if full_model_name in dependencies:
+                dependencies.discard(full_model_name)
+
+                if not dependencies:
+                    log_message = f'[{dependent_model_name}] dependencies are deployed, starting deployment'
+                    logging.getLogger(dependent_model_name).info(log_message)
+                    logging.getLogger('_task_info').info(log_message)
+                    self._dispatch(self.pending_statuses.pop(dependent_model_name))
+
+        self.pending_dependencies = {model: deps for model, deps in self.pending_dependencies.items() if deps}
+
+    def _cancel_dependents(self, full_model_name: str) -> None:
+        dependent_model_names = [model for model, deps in self.pending_dependencies.items() if full_model_name in deps]
 
-            log_file_name = f'{utc_timestamp_str}_{full_model_name}.log'
-            log_file_path = self.config['paths']['log_dir'] / log_file_name
+        for dependent_model_name in dependent_model_names:
+            del self.pending_dependencies[dependent_model_name]
+            del self.pending_statuses[dependent_model_name]
+            self.current_task = self.current_task - {dependent_model_name}
+            self.failed_models.add(dependent_model_name)
 
-            file_handler = logging.FileHandler(log_file_path)
-            file_handler.setLevel(logging.INFO)
-            formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+            log_message = f'[{dependent_model_name}] DEPLOYMENT CANCELLED: dependency {full_model_name} failed'
+            logging.getLogger(dependent_model_name).error(log_message)
+            logging.getLogger('_task_info').error(log_message)
 
-    def deploy(self, full_model_names: list) -> None:
+            self._cancel_dependents(dependent_model_name)
+
+    def deploy(self, full_model_names: list, resume: bool = False) -> None:
+        try:
+            self._deploy(full_model_names, resume)
+        finally:
+            self._export_metrics()
+            self._write_trace()
+            self._teardown_loggers()
+
+            for stage_executor in self.stages.values():
+                stage_executor.stop()
+
+            safe_delete_path(self.config['paths']['temp_dir'])
+
+    def _deploy(self, full_model_names: list, resume: bool) -> None:
         self.current_task = set(full_model_names)
+        self.stage_timings = []
+        # failed and cancelled models of the task
+        self.failed_models = set()
         full_model_names = list(self.current_task)
         self._setup_loggers(full_model_names + ['_task_info'])
 
-        task_info = []
+        completed_stages = self.journal.get_completed_stages() if resume else {}
+        templates_dir = self.config['paths']['templates_dir']
+        deployment_statuses = {}
+        skipped_stages = {}
+        gate_stages = {}
+        gate_passed = set()
 
         for full_model_name in full_model_names:
-            pipeline_name = self.config['models'][full_model_name]['pipeline']
+            model_config = self.config['models'][full_model_name]
+            pipeline_name = model_config['pipeline']
             pipeline = deepcopy(preset_pipelines[pipeline_name]['pipeline'])
             deployment_status = DeploymentStatus(full_model_name, pipeline)
 
+            # dependents are started after model passes its gate stage or, if there is no one, its last stage
+            gate_stage = next((stage for stage in dependency_gate_stages if stage in pipeline), pipeline[-1])
+            gate_stages[full_model_name] = gate_stage.__name__
+
+            # skip leading stages which were completed by previous run with the same inputs
+            fingerprint = get_model_fingerprint(model_config, templates_dir)
+            self.fingerprints[full_model_name] = fingerprint
+            model_completed_stages = completed_stages.get(full_model_name, {})
+            skipped_stages[full_model_name] = []
+
+            while pipeline and model_completed_stages.get(pipeline[0].__name__) == fingerprint:
+                skipped_stages[full_model_name].append(pipeline.pop(0).__name__)
+
+            if gate_stages[full_model_name] in skipped_stages[full_model_name]:
+                gate_passed.add(full_model_name)
+
+            deployment_statuses[full_model_name] = deployment_status
+
+        # dependencies outside the task are considered to be already deployed
+        dependencies = {model: set(self.config['models'][model].get('depends_on', [])) & self.current_task
+                        for model in full_model_names}
+        check_dependency_cycles(dependencies)
+        self.task_dependencies = dependencies
+
+        # only stages which are used by the task pipelines are started
+        used_stages = {stage for status in deployment_statuses.values() for stage in status.pipeline}
+        self._start_stages([stage for stage in all_stages if stage in used_stages], full_model_names)
+
+        # journal is written only after task config is validated and stages are started, so failed task setup
+        # does not overwrite records needed to resume the previous run
+        for full_model_name in full_model_names:
+            fingerprint = self.fingerprints[full_model_name]
+
+            # new start invalidates journal records of previous runs, so skipped stages are recorded once again
+            self.journal.start(full_model_name, fingerprint)
+            for stage_name in skipped_stages[full_model_name]:
+                self.journal.complete(full_model_name, stage_name, fingerprint, skipped=True)
+
+        dependencies = {model: deps - gate_passed for model, deps in dependencies.items()}
+
+        self.pending_dependencies = {model: deps for model, deps in dependencies.items() if deps}
+        self.pending_statuses = {}
+        task_info = []
+
+        for full_model_name, deployment_status in deployment_statuses.items():
+            pipeline = deployment_status.pipeline
+
             info_str = f'\t[{full_model_name}]:\t\t[{", ".join([stage.__name__ for stage in pipeline])}]'
+            if skipped_stages[full_model_name]:
+                info_str = f'{info_str}, resumed after: [{", ".join(skipped_stages[full_model_name])}]'
+            if dependencies[full_model_name]:
+                info_str = f'{info_str}, depends on: [{", ".join(sorted(dependencies[full_model_name]))}]'
             task_info.append(info_str)
 
-            first_stage_class_name = deployment_status.pipeline.pop(0).__name__
-            first_stage: AbstractDeploymentStage = self.stages[first_stage_class_name]
-            first_stage.in_queue.put(deployment_status)
+            if not pipeline:
+                self.current_task = self.current_task - {full_model_name}
+                log_message = f'[{full_model_name}] DEPLOYMENT FINISHED: all stages were completed by previous runs'
+                logging.getLogger(full_model_name).info(log_message)
+                logging.getLogger('_task_info').info(log_message)
+            elif full_model_name in self.pending_dependencies:
+                self.pending_statuses[full_model_name] = deployment_status
+            else:
+                self._dispatch(deployment_status)
 
         logger: Logger = logging.getLogger('_task_info')
         task_info = '\n'.join(task_info)
         logger.info(f'Created task:\n{task_info}')
 
         while len(self.current_task) > 0:
-            for stage in self.stages.values():
-                stage: AbstractDeploymentStage = stage
+            if self.metrics.is_export_due():
+                self._export_metrics()
+
+            try:
+                # waiting is limited to export metrics periodically while stages are running
+                q_get = self.out_queue.get(timeout=self.metrics.export_interval_sec if self.metrics.enabled else None)
+            except queue.Empty:
+                continue
+
+            if isinstance(q_get, DeploymentStatus):
+                deployment_status: DeploymentStatus = q_get
+                full_model_name = deployment_status.full_model_name
+                self.stage_timings.append((full_model_name, deployment_status.current_stage,
+                                           deployment_status.enqueue_time, deployment_status.start_time,
+                                           deployment_status.end_time, deployment_status.finish))
+                self.metrics.observe_result(deployment_status, self.config['models'][full_model_name]['pipeline'])
 
-                try:
-                    q_get = stage.out_queue.get_nowait()
-                except Empty:
-                    q_get = None
+                if deployment_status.finish:
+                    self.current_task = self.current_task - {full_model_name}
+                    self.failed_models.add(full_model_name)
+                    self._cancel_dependents(full_model_name)
+                    continue
 
-                if isinstance(q_get, DeploymentStatus):
-                    deployment_status: DeploymentStatus = q_get
+                self.journal.complete(full_model_name, deployment_status.current_stage,
+                                      self.fingerprints[full_model_name])
 
-                    if deployment_status.finish:
-                        self.current_task = self.current_task - {deployment_status.full_model_name}
-                    elif deployment_status.pipeline:
-                        next_stage: AbstractDeploymentStage = self.stages[deployment_status.pipeline.pop(0).__name__]
-                        next_stage.in_queue.put(deployment_status)
-                    elif not deployment_status.pipeline:
-                        self.current_task = self.current_task - {deployment_status.full_model_name}
-                        log_message = f'[{deployment_status.full_model_name}] DEPLOYMENT FINISHED'
+                if deployment_status.current_stage == gate_stages[full_model_name]:
+                    self._release_dependents(full_model_name)
 
-                        logger: Logger = logging.getLogger(deployment_status.full_model_name)
-                        logger.info(log_message)
+                if deployment_status.pipeline:
+                    self._dispatch(deployment_status)
+                else:
+                    self.current_task = self.current_task - {full_model_name}
+                    log_message = f'[{full_model_name}] DEPLOYMENT FINISHED'
 
-                        task_logger: Logger = logging.getLogger('_task_info')
-                        task_logger.info(log_message)
+                    logger: Logger = logging.getLogger(full_model_name)
+                    logger.info(log_message)
 
-                elif isinstance(q_get, LogMessage):
-                    log_message: LogMessage = q_get
-                    logger: Logger = logging.getLogger(log_message.full_model_name)
+                    task_logger: Logger = logging.getLogger('_task_info')
+                    task_logger.info(log_message)
 
-                    if self.config['extended_deployer_logging'] and log_message.extended_log_message:
-                        log_text = f'{log_message.log_message}, extended info: {log_message.extended_log_message}'
-                    else:
-                        log_text = log_message.log_message
+            elif isinstance(q_get, LogMessage):
+                log_message: LogMessage = q_get
+                logger: Logger = logging.getLogger(log_message.full_model_name)
 
-                    logger.log(log_message.log_level.value, log_text)
+                if self.config['extended_deployer_logging'] and log_message.extended_log_message:
+                    log_text = f'{log_message.log_message}, extended info: {log_message.extended_log_message}'
+                else:
+                    log_text = log_message.log_message
 
-        for stage in self.stages.values():
-            stage.terminate()
+                logger.log(log_message.log_level.value, log_text,
+                           extra={'extended_log_message': log_message.extended_log_message})
 
-        safe_delete_path(self.config['paths']['temp_dir'])
+        # records of successfully deployed models are not needed for resume anymore
+        if not self.failed_models:
+            self.journal.compact(full_model_names)
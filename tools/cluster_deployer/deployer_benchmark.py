@@ -0,0 +1,178 @@
+import queue
+import resource
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from statistics import mean
+from typing import Iterator, Optional
+
+import deployer_kuber
+import deployer_stages
+from deployer import Deployer
+from deployer_fakes import FakeDockerClient, FakeHttpSession, FakeKuberClients
+from deployer_stages import DeploymentStatus, MakeFilesDeploymentStage, BuildImageDeploymentStage
+from deployer_stages import TestImageDeploymentStage, PushImageDeploymentStage, PullImageDeploymentStage
+from deployer_stages import DeployKuberDeploymentStage, TestKuberDeploymentStage, DeleteKuberDeploymentStage
+from deployer_stages import PushToDockerHubDeploymentStage
+from deployer_utils import ModelsConfig, safe_delete_path
+from pipelines import all_stages, preset_pipelines
+
+# fakes settings used if config has no "fakes" section, see deployer_fakes
+benchmark_fakes = {
+    'latency_sec': {'default': 0.01, 'build': 0.2, 'push': 0.1, 'pull': 0.1, 'rollout': 0.1, 'prepull': 0.1},
+    'failure_rate': {'default': 0.0}
+}
+
+# stages which state is required by benchmarked stage, they are run beforehand if pipeline does not contain them
+benchmark_prerequisites = {
+    TestImageDeploymentStage: [BuildImageDeploymentStage],
+    PushImageDeploymentStage: [BuildImageDeploymentStage],
+    PullImageDeploymentStage: [BuildImageDeploymentStage, PushImageDeploymentStage],
+    PushToDockerHubDeploymentStage: [BuildImageDeploymentStage],
+    DeleteKuberDeploymentStage: [DeployKuberDeploymentStage],
+    TestKuberDeploymentStage: [DeployKuberDeploymentStage]
+}
+
+# paths which are written by deployer are redirected to benchmark temp dir
+benchmark_output_paths = ['models_dir', 'kuber_configs_dir', 'temp_dir', 'log_dir', 'journal_dir',
+                          'build_index_dir', 'manifests_dir']
+
+
+def _get_prototype_model(config: dict) -> str:
+    """Returns first model which template has both docker image and Kubernetes files."""
+    models: ModelsConfig = config['models']
+    templates_dir: Path = config['paths']['templates_dir']
+
+    for full_model_name, model_config in models.raw_models.items():
+        template_dir = templates_dir / model_config['TEMPLATE']
+        if (template_dir / 'Dockerfile').is_file() and (template_dir / 'kuber_dp.yaml').is_file():
+            return full_model_name
+
+    raise ValueError('No model with docker and Kubernetes template files found')
+
+
+def _make_benchmark_config(config: dict, output_dir: Path, backend: Optional[str]) -> dict:
+    benchmark_config = dict(config)
+    benchmark_config.setdefault('fakes', benchmark_fakes)
+    benchmark_config['dockerhub_password'] = None
+    benchmark_config['paths'] = {**config['paths'], **{path: output_dir / path for path in benchmark_output_paths}}
+
+    if backend:
+        benchmark_config['stages'] = {name: {**settings, 'backend': backend}
+                                      for name, settings in config.get('stages', {}).items()}
+
+    return benchmark_config
+
+
+@contextmanager
+def _fake_clients(fakes_config: dict) -> Iterator[None]:
+    """Replaces stage docker, HTTP and Kubernetes clients factories with fakes factories."""
+    factories = (deployer_stages.docker_client_factory, deployer_stages.http_session_factory,
+                 deployer_kuber.kuber_clients_factory)
+
+    deployer_stages.docker_client_factory = lambda config: FakeDockerClient(fakes_config)
+    deployer_stages.http_session_factory = lambda config: FakeHttpSession(fakes_config)
+    deployer_kuber.kuber_clients_factory = lambda: FakeKuberClients(fakes_config)
+
+    try:
+        yield
+    finally:
+        deployer_stages.docker_client_factory, deployer_stages.http_session_factory, \
+            deployer_kuber.kuber_clients_factory = factories
+
+
+def _make_models(config: dict, prototype_model: str, pipeline_name: str, pipeline_index: int,
+                 models_num: int) -> ModelsConfig:
+    models: ModelsConfig = config['models']
+    prototype_config: dict = models.raw_models[prototype_model]
+
+    raw_models = {f'bench{pipeline_index}_model_{i:04d}': {**prototype_config,
+                                                           'pipeline': pipeline_name,
+                                                           'depends_on': []}
+                  for i in range(models_num)}
+
+    return ModelsConfig(raw_models, models.templates, {})
+
+
+def _prepare_models(config: dict, pipeline: list, full_model_names: list) -> None:
+    """Makes deployment files and fake docker and Kubernetes state required by pipeline stages."""
+    prerequisites = [MakeFilesDeploymentStage]
+
+    for stage_class in pipeline:
+        for prerequisite in benchmark_prerequisites.get(stage_class, []):
+            if prerequisite not in pipeline and prerequisite not in prerequisites:
+                prerequisites.append(prerequisite)
+
+    # preparation log messages are discarded
+    log_queue = queue.Queue()
+
+    for stage_class in prerequisites:
+        stage = stage_class(config, None, log_queue)
+        for full_model_name in full_model_names:
+            stage._act(DeploymentStatus(full_model_name, []))
+
+
+def _get_thread_cpu_time() -> float:
+    # time.thread_time is not available in Python 3.6
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _get_report(pipeline_name: str, deployer: Deployer, wall_time: float, coordinator_cpu_time: float) -> str:
+    self_max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+    queue_waits = defaultdict(list)
+    durations = defaultdict(list)
+    failed = set()
+
+    for full_model_name, stage_name, enqueue_time, start_time, end_time, is_failed in deployer.stage_timings:
+        queue_waits[stage_name].append(start_time - enqueue_time)
+        durations[stage_name].append(end_time - start_time)
+        if is_failed:
+            failed.add(full_model_name)
+
+    stage_names = [stage.__name__ for stage in all_stages if stage.__name__ in queue_waits]
+    stages_report = [f'\t{stage_name}: queue wait avg {mean(queue_waits[stage_name]):.3f}s, '
+                     f'max {max(queue_waits[stage_name]):.3f}s, '
+                     f'duration avg {mean(durations[stage_name]):.3f}s' for stage_name in stage_names]
+
+    return '\n'.join([f'{pipeline_name}: wall time {wall_time:.2f}s, coordinator CPU {coordinator_cpu_time:.2f}s, '
+                      f'peak RSS {self_max_rss:.0f} MB, '
+                      f'failed models: {len(failed)}', *stages_report])
+
+
+def run_benchmark(config: dict, models_num: int, pipeline_names: Optional[list] = None,
+                  prototype_model: Optional[str] = None, backend: Optional[str] = None) -> None:
+    """Deploys synthetic models through preset pipelines with fake docker and Kubernetes clients.
+
+    Synthetic models are copies of prototype model config, peak RSS is cumulative for the benchmark process.
+    """
+    pipeline_names = pipeline_names or list(preset_pipelines.keys())
+    prototype_model = prototype_model or _get_prototype_model(config)
+    output_dir = Path(tempfile.mkdtemp(prefix='deployer_benchmark_'))
+    benchmark_config = _make_benchmark_config(config, output_dir, backend)
+
+    print(f'Benchmark: {models_num} models based on {prototype_model}, output dir: {output_dir}')
+
+    try:
+        with _fake_clients(benchmark_config['fakes']):
+            for pipeline_index, pipeline_name in enumerate(pipeline_names):
+                benchmark_config['models'] = _make_models(config, prototype_model, pipeline_name, pipeline_index,
+                                                          models_num)
+                full_model_names = list(benchmark_config['models'].keys())
+
+                _prepare_models(benchmark_config, preset_pipelines[pipeline_name]['pipeline'], full_model_names)
+
+                deployer = Deployer(benchmark_config)
+                start_time = time.monotonic()
+                start_cpu_time = _get_thread_cpu_time()
+
+                deployer.deploy(full_model_names)
+
+                report = _get_report(pipeline_name, deployer, time.monotonic() - start_time,
+                                     _get_thread_cpu_time() - start_cpu_time)
+                print(report, flush=True)
+    finally:
+        safe_delete_path(output_dir)
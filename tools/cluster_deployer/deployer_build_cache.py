@@ -0,0 +1,94 @@
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+from docker.utils.build import PatternMatcher
+
+BUILD_FINGERPRINT_LABEL = 'deployer.build_fingerprint'
+
+
+def get_files_fingerprint(build_files: dict, buildargs: dict) -> str:
+    """Returns hash of docker image build inputs: build context files {relative path: contents} and build args."""
+    fingerprint = hashlib.sha256()
+    fingerprint.update(json.dumps(buildargs, sort_keys=True).encode('utf-8'))
+
+    for file_name in sorted(build_files.keys()):
+        fingerprint.update(file_name.encode('utf-8'))
+        fingerprint.update(build_files[file_name])
+
+    return fingerprint.hexdigest()
+
+
+def get_build_fingerprint(build_dir: Path, buildargs: dict) -> str:
+    """Returns hash of docker image build inputs: build directory files and build args."""
+    build_files = {path.relative_to(build_dir).as_posix(): path.read_bytes()
+                   for path in build_dir.rglob('*') if path.is_file()}
+
+    return get_files_fingerprint(build_files, buildargs)
+
+
+def make_build_context(build_files: dict) -> io.BytesIO:
+    """Returns uncompressed tar build context made from files {relative path: contents}.
+
+    Files matching .dockerignore patterns are not added, file times are zeroed to keep context reproducible.
+    """
+    dockerignore = build_files.get('.dockerignore', b'').decode('utf-8')
+    patterns = [line.strip() for line in dockerignore.splitlines() if line.strip() and not line.startswith('#')]
+    pattern_matcher = PatternMatcher(patterns + ['!Dockerfile'])
+
+    build_context = io.BytesIO()
+
+    with tarfile.open(fileobj=build_context, mode='w') as tar:
+        for file_name in sorted(build_files.keys()):
+            if pattern_matcher.matches(file_name):
+                continue
+
+            tar_info = tarfile.TarInfo(file_name)
+            tar_info.size = len(build_files[file_name])
+            tar_info.mode = 0o644
+            tar.addfile(tar_info, io.BytesIO(build_files[file_name]))
+
+    build_context.seek(0)
+
+    return build_context
+
+
+class ImageBuildIndex:
+    """Local index of images pushed to the cluster registry: image tag -> build fingerprint and registry digest.
+
+    Each image is stored in separate file which is replaced atomically, so index can be updated concurrently
+    by several stage workers.
+    """
+    def __init__(self, index_dir: Path):
+        self.index_dir: Path = index_dir
+
+    def _get_entry_path(self, image_tag: str) -> Path:
+        file_name = re.sub(r'[^A-Za-z0-9_.-]', '_', image_tag)
+        return self.index_dir / f'{file_name}.json'
+
+    def get(self, image_tag: str) -> Optional[dict]:
+        entry_path = self._get_entry_path(image_tag)
+
+        try:
+            with entry_path.open('r') as f:
+                entry: dict = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return entry if entry.get('image_tag') == image_tag else None
+
+    def put(self, image_tag: str, fingerprint: str, digest: str) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        entry_path = self._get_entry_path(image_tag)
+        temp_entry_path = entry_path.with_name(f'.{entry_path.name}.{os.getpid()}.{threading.get_ident()}')
+
+        with temp_entry_path.open('w') as f:
+            json.dump({'image_tag': image_tag, 'fingerprint': fingerprint, 'digest': digest}, f, indent=2)
+
+        temp_entry_path.replace(entry_path)
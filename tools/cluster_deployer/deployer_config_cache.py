@@ -0,0 +1,85 @@
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Optional
+
+# should be incremented when compiled config structure is changed
+CONFIG_CACHE_VERSION = 2
+
+
+def get_file_hash(file_path: Path) -> str:
+    return hashlib.sha256(file_path.read_bytes()).hexdigest()
+
+
+class ConfigCache:
+    """On-disk cache of compiled config keyed by input files modification times and contents hashes.
+
+    Input file with changed modification time is hashed, cached config stays valid if file contents are not
+    changed. Compiled config is also keyed by extra params which affect compilation (e.g. root dir).
+    """
+    def __init__(self, cache_path: Path, input_files: list, params: dict) -> None:
+        self.cache_path: Path = cache_path
+        self.input_files: list = [str(path) for path in input_files]
+        self.params: dict = params
+        self._files: Optional[dict] = None
+
+    def _is_valid(self, entry: dict) -> bool:
+        """Checks entry inputs, updates modification times of files with unchanged contents in the entry."""
+        if entry.get('version') != CONFIG_CACHE_VERSION or entry.get('params') != self.params:
+            return False
+
+        if list(entry['files'].keys()) != self.input_files:
+            return False
+
+        for file_name, (mtime_ns, file_hash) in entry['files'].items():
+            file_path = Path(file_name)
+            file_mtime_ns = file_path.stat().st_mtime_ns
+
+            if file_mtime_ns != mtime_ns:
+                if get_file_hash(file_path) != file_hash:
+                    return False
+
+                entry['files'][file_name] = (file_mtime_ns, file_hash)
+                entry['touched'] = True
+
+        return True
+
+    def _snapshot_files(self) -> dict:
+        return {file_name: (Path(file_name).stat().st_mtime_ns, get_file_hash(Path(file_name)))
+                for file_name in self.input_files}
+
+    def _load(self) -> Optional[dict]:
+        try:
+            with self.cache_path.open('rb') as f:
+                entry: dict = pickle.load(f)
+
+            return entry if self._is_valid(entry) else None
+        except Exception:
+            return None
+
+    def get(self) -> Optional[Any]:
+        entry = self._load()
+
+        if entry is None:
+            # inputs are snapshotted before compilation, so files changed during compilation invalidate cache
+            self._files = self._snapshot_files()
+            return None
+
+        if entry.pop('touched', False):
+            self._write(entry)
+
+        return entry['config']
+
+    def put(self, config: Any) -> None:
+        files = self._files or self._snapshot_files()
+        self._write({'version': CONFIG_CACHE_VERSION, 'params': self.params, 'files': files, 'config': config})
+
+    def _write(self, entry: dict) -> None:
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_cache_path = self.cache_path.with_name(f'.{self.cache_path.name}.{os.getpid()}')
+
+        with temp_cache_path.open('wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        temp_cache_path.replace(self.cache_path)
@@ -0,0 +1,66 @@
+import multiprocessing
+import queue
+from abc import ABCMeta, abstractmethod
+from threading import Thread
+
+
+class AbstractStageExecutor(metaclass=ABCMeta):
+    """Runs workers of one deployment stage, each worker is a stage instance processing items from in_queue.
+
+    Workers are stopped with None put to in_queue, one per worker.
+    """
+    queue_class = None
+
+    def __init__(self, stages: list, name: str) -> None:
+        self.stages: list = stages
+        self.name: str = name
+
+    @abstractmethod
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        for stage in self.stages:
+            stage.in_queue.put(None)
+
+
+class ProcessStageExecutor(AbstractStageExecutor):
+    """Runs each worker in a separate process, for CPU-bound stages."""
+    queue_class = multiprocessing.Queue
+
+    def __init__(self, stages: list, name: str) -> None:
+        super(ProcessStageExecutor, self).__init__(stages, name)
+        self.processes = [multiprocessing.Process(target=stage.run, name=f'{name}-{i}')
+                          for i, stage in enumerate(stages)]
+
+    def start(self) -> None:
+        for process in self.processes:
+            process.start()
+
+    def stop(self) -> None:
+        # process can be blocked in long running stage action, so it is terminated instead of waiting for None
+        for process in self.processes:
+            process.terminate()
+
+        # terminated processes are joined so they do not stay zombies while deployer runs next tasks
+        for process in self.processes:
+            process.join()
+
+
+class ThreadStageExecutor(AbstractStageExecutor):
+    """Runs each worker in a thread of the deployer process, for I/O-bound stages."""
+    queue_class = queue.Queue
+
+    def __init__(self, stages: list, name: str) -> None:
+        super(ThreadStageExecutor, self).__init__(stages, name)
+        self.threads = [Thread(target=stage.run, name=f'{name}-{i}', daemon=True) for i, stage in enumerate(stages)]
+
+    def start(self) -> None:
+        for thread in self.threads:
+            thread.start()
+
+
+stage_executors = {
+    'process': ProcessStageExecutor,
+    'thread': ThreadStageExecutor
+}
@@ -0,0 +1,545 @@
+"""In-process fakes of docker daemon and registry, Kubernetes API and model HTTP API.
+
+Benchmark replaces stage clients factories with fakes factories, so deployer can be run and benchmarked without
+docker, registry and cluster. Fakes settings are taken from config "fakes" section:
+
+    fakes:
+      # operation latency, seconds: default and per operation
+      latency_sec: {default: 0.01, build: 0.5}
+      # probability of operation failure: default and per operation
+      failure_rate: {default: 0.0, build: 0.1}
+      # cluster nodes number
+      nodes: 3
+
+Operations: build, push, pull, remove, run, login, probe, create, replace, patch, delete, rollout, prepull.
+Fake state is kept in memory of the process, so stages which share state (e.g. Kubernetes stages) should be run
+by thread backend.
+"""
+import hashlib
+import random
+import threading
+import time
+import uuid
+from copy import deepcopy
+from datetime import datetime
+from typing import Any, Optional
+
+from docker.errors import APIError, ImageNotFound, NotFound
+from kubernetes.client.rest import ApiException
+
+from deployer_kuber import REVISION_ANNOTATION
+
+FAKE_BUILD_STEPS = 4
+FAKE_IMAGE_LAYERS = 3
+FAKE_LAYER_SIZE = 10 * 2 ** 20
+
+
+class FakeSettings:
+    def __init__(self, fakes_config: dict) -> None:
+        self.latencies: dict = fakes_config.get('latency_sec', {})
+        self.failure_rates: dict = fakes_config.get('failure_rate', {})
+        self.nodes: int = fakes_config.get('nodes', 3)
+
+    def get_latency(self, operation: str) -> float:
+        return self.latencies.get(operation, self.latencies.get('default', 0))
+
+    def wait(self, operation: str, fraction: float = 1.0) -> None:
+        time.sleep(self.get_latency(operation) * fraction)
+
+    def fails(self, operation: str) -> bool:
+        return random.random() < self.failure_rates.get(operation, self.failure_rates.get('default', 0))
+
+
+def _get_digest(*values: Any) -> str:
+    return f'sha256:{hashlib.sha256(repr(values).encode("utf-8")).hexdigest()}'
+
+
+class FakeDockerState:
+    """Local images and registry contents shared by all fake docker clients of the process."""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # image tag -> {'id': image id, 'labels': image labels}
+        self.images: dict = {}
+        # image tag -> registry digest
+        self.registry: dict = {}
+
+
+_docker_state = FakeDockerState()
+
+
+class FakeImage:
+    def __init__(self, tag: str, image_data: dict) -> None:
+        self.tags: list = [tag]
+        self.id: str = image_data['id']
+        self.labels: dict = image_data['labels']
+
+    def tag(self, repository: str, tag: Optional[str] = None) -> bool:
+        with _docker_state.lock:
+            _docker_state.images[f'{repository}:{tag}' if tag else repository] = \
+                {'id': self.id, 'labels': self.labels}
+        return True
+
+
+class FakeRegistryData:
+    def __init__(self, digest: str) -> None:
+        self.id: str = digest
+
+
+class FakeImagesCollection:
+    def __init__(self, settings: FakeSettings) -> None:
+        self.settings: FakeSettings = settings
+
+    def get(self, tag: str) -> FakeImage:
+        with _docker_state.lock:
+            image_data = _docker_state.images.get(tag)
+
+        if image_data is None:
+            raise ImageNotFound(f'No such image: {tag}')
+
+        return FakeImage(tag, image_data)
+
+    def remove(self, tag: str, **kwargs) -> None:
+        self.settings.wait('remove')
+
+        with _docker_state.lock:
+            if _docker_state.images.pop(tag, None) is None:
+                raise ImageNotFound(f'No such image: {tag}')
+
+    def get_registry_data(self, tag: str) -> FakeRegistryData:
+        with _docker_state.lock:
+            digest = _docker_state.registry.get(tag)
+
+        if digest is None:
+            raise NotFound(f'manifest for {tag} not found')
+
+        return FakeRegistryData(digest)
+
+
+class FakeContainer:
+    def stop(self) -> None:
+        pass
+
+
+class FakeContainersCollection:
+    def __init__(self, settings: FakeSettings) -> None:
+        self.settings: FakeSettings = settings
+
+    def run(self, image: str, **kwargs) -> FakeContainer:
+        self.settings.wait('run')
+
+        if self.settings.fails('run'):
+            raise APIError(f'fake container run failure: {image}')
+
+        return FakeContainer()
+
+
+class FakeDockerAPIClient:
+    """Fake of low level docker API client, streams are generated with the same chunks as docker daemon sends."""
+    def __init__(self, settings: FakeSettings) -> None:
+        self.settings: FakeSettings = settings
+
+    def build(self, tag: str, labels: Optional[dict] = None, **kwargs):
+        for step in range(1, FAKE_BUILD_STEPS + 1):
+            yield {'stream': f'Step {step}/{FAKE_BUILD_STEPS} : RUN fake step {step}\n'}
+            self.settings.wait('build', 1 / FAKE_BUILD_STEPS)
+
+            if step == FAKE_BUILD_STEPS and self.settings.fails('build'):
+                yield {'error': f'fake build failure: {tag}'}
+                return
+
+            yield {'stream': f' ---> Running in {_get_digest(tag, step)[7:19]}\n'}
+
+        image_id = _get_digest(tag, time.time())
+
+        with _docker_state.lock:
+            _docker_state.images[tag] = {'id': image_id, 'labels': labels or {}}
+
+        yield {'aux': {'ID': image_id}}
+        yield {'stream': f'Successfully built {image_id[7:19]}\n'}
+
+    def _stream_layers(self, tag: str, operation: str, statuses: tuple):
+        start_status, progress_status, end_status = statuses
+
+        for layer in range(FAKE_IMAGE_LAYERS):
+            layer_id = _get_digest(tag, layer)[7:19]
+            yield {'status': start_status, 'id': layer_id}
+            self.settings.wait(operation, 1 / FAKE_IMAGE_LAYERS)
+            yield {'status': progress_status, 'id': layer_id,
+                   'progressDetail': {'current': FAKE_LAYER_SIZE, 'total': FAKE_LAYER_SIZE}}
+            yield {'status': end_status, 'id': layer_id}
+
+        if self.settings.fails(operation):
+            yield {'error': f'fake {operation} failure: {tag}'}
+
+    def push(self, repository: str, tag: Optional[str] = None, **kwargs):
+        image_tag = f'{repository}:{tag}' if tag else repository
+
+        with _docker_state.lock:
+            image_data = _docker_state.images.get(image_tag)
+
+        if image_data is None:
+            yield {'error': f'An image does not exist locally with the tag: {image_tag}'}
+            return
+
+        yield from self._stream_layers(image_tag, 'push', ('Preparing', 'Pushing', 'Pushed'))
+
+        digest = _get_digest(image_data['id'])
+
+        with _docker_state.lock:
+            _docker_state.registry[image_tag] = digest
+
+        yield {'status': f'latest: digest: {digest} size: 1234', 'aux': {'Tag': 'latest', 'Digest': digest}}
+
+    def pull(self, repository: str, tag: Optional[str] = None, **kwargs):
+        image_tag = repository if tag in (None, 'latest') else f'{repository}:{tag}'
+
+        with _docker_state.lock:
+            digest = _docker_state.registry.get(image_tag)
+
+        if digest is None:
+            raise NotFound(f'manifest for {image_tag} not found')
+
+        yield from self._stream_layers(image_tag, 'pull', ('Pulling fs layer', 'Downloading', 'Pull complete'))
+        yield {'status': f'Digest: {digest}'}
+
+
+class FakeDockerClient:
+    def __init__(self, fakes_config: dict) -> None:
+        self.settings = FakeSettings(fakes_config)
+        self.images = FakeImagesCollection(self.settings)
+        self.containers = FakeContainersCollection(self.settings)
+        self.api = FakeDockerAPIClient(self.settings)
+
+    def login(self, username: str, password: Optional[str] = None, **kwargs) -> dict:
+        self.settings.wait('login')
+        return {'Status': 'Login Succeeded'}
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, json_data: Any) -> None:
+        self.status_code: int = status_code
+        self._json_data: Any = json_data
+
+    def json(self) -> Any:
+        return self._json_data
+
+
+class FakeHttpSession:
+    """Fake of requests session for model API probes."""
+    def __init__(self, fakes_config: dict) -> None:
+        self.settings = FakeSettings(fakes_config)
+
+    def post(self, url: str, **kwargs) -> FakeResponse:
+        self.settings.wait('probe')
+
+        if self.settings.fails('probe'):
+            return FakeResponse(500, {'error': 'fake model failure'})
+
+        return FakeResponse(200, [['fake model response']])
+
+
+def _to_camel_case(name: str) -> str:
+    first, *rest = name.split('_')
+    return first + ''.join(part.capitalize() for part in rest)
+
+
+class FakeKuberObject:
+    """Attribute access to Kubernetes object dict in the same way as to Kubernetes client models."""
+    # values of these fields are kept as dicts in Kubernetes client models
+    dict_fields = {'labels', 'annotations', 'matchLabels', 'nodeSelector'}
+
+    def __init__(self, data: dict) -> None:
+        self._data: dict = data
+
+    @staticmethod
+    def wrap(value: Any) -> Any:
+        if isinstance(value, dict):
+            return FakeKuberObject(value)
+        elif isinstance(value, list):
+            return [FakeKuberObject.wrap(item) for item in value]
+        return value
+
+    def __getattr__(self, name: str) -> Any:
+        key = _to_camel_case(name)
+        value = self._data.get(key)
+        return value if key in self.dict_fields else self.wrap(value)
+
+
+class FakeApiClient:
+    @staticmethod
+    def sanitize_for_serialization(obj: Any) -> Any:
+        return obj._data if isinstance(obj, FakeKuberObject) else obj
+
+
+class FakeKuberCluster:
+    """Kubernetes objects store with watch events and simulated Deployments controller."""
+    def __init__(self, settings: FakeSettings) -> None:
+        self.settings: FakeSettings = settings
+        self.condition = threading.Condition()
+        self.resource_version: int = 0
+        # (kind, namespace) -> {name: object dict}
+        self.objects: dict = {}
+        # (kind, namespace) -> list of (resource version, event type, object dict)
+        self.events: dict = {}
+
+    def _emit(self, kind: str, namespace: str, event_type: str, data: dict) -> None:
+        """Stores object change and notifies watches, should be called with condition acquired."""
+        self.resource_version += 1
+        data['metadata']['resourceVersion'] = str(self.resource_version)
+        namespace_objects: dict = self.objects.setdefault((kind, namespace), {})
+
+        if event_type == 'DELETED':
+            namespace_objects.pop(data['metadata']['name'], None)
+        else:
+            namespace_objects[data['metadata']['name']] = data
+
+        self.events.setdefault((kind, namespace), []).append((self.resource_version, event_type, data))
+        self.condition.notify_all()
+
+    def list(self, kind: str, namespace: str) -> FakeKuberObject:
+        with self.condition:
+            items = list(self.objects.get((kind, namespace), {}).values())
+            return FakeKuberObject({'items': items, 'metadata': {'resourceVersion': str(self.resource_version)}})
+
+    def stream(self, kind: str, namespace: str, resource_version: str, timeout_seconds: float):
+        deadline = time.monotonic() + timeout_seconds
+        last_version = int(resource_version or 0)
+
+        while True:
+            with self.condition:
+                events = [event for event in self.events.get((kind, namespace), []) if event[0] > last_version]
+
+                if not events:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        return
+                    self.condition.wait(timeout)
+                    continue
+
+            for version, event_type, data in events:
+                last_version = version
+                yield {'type': event_type, 'object': FakeKuberObject(data)}
+
+    def get(self, kind: str, namespace: str, name: str) -> dict:
+        with self.condition:
+            data = self.objects.get((kind, namespace), {}).get(name)
+
+        if data is None:
+            raise ApiException(status=404, reason=f'{kind} {name} not found')
+
+        return data
+
+    def create(self, kind: str, namespace: str, body: dict, operation: str = 'create') -> FakeKuberObject:
+        self.settings.wait(operation)
+
+        if self.settings.fails(operation):
+            raise ApiException(status=500, reason=f'fake {operation} failure')
+
+        data: dict = deepcopy(body)
+        data.setdefault('metadata', {})['namespace'] = namespace
+        name = data['metadata']['name']
+
+        if kind == 'deployment':
+            data['spec'].setdefault('replicas', 1)
+
+        with self.condition:
+            old_data = self.objects.get((kind, namespace), {}).get(name)
+
+            if operation == 'create' and old_data is not None:
+                raise ApiException(status=409, reason=f'{kind} {name} already exists')
+            elif operation != 'create' and old_data is None:
+                raise ApiException(status=404, reason=f'{kind} {name} not found')
+
+            old_metadata: dict = old_data['metadata'] if old_data else {}
+            data['metadata']['uid'] = old_metadata.get('uid', str(uuid.uuid4()))
+            data['metadata']['generation'] = old_metadata.get('generation', 0) + 1
+            data['metadata']['creationTimestamp'] = old_metadata.get('creationTimestamp', datetime.utcnow())
+            data['status'] = old_data.get('status', {}) if old_data else {}
+            self._emit(kind, namespace, 'MODIFIED' if old_data else 'ADDED', data)
+
+        if kind == 'deployment':
+            threading.Thread(target=self._roll_out, args=(namespace, name, data['metadata']['generation']),
+                             daemon=True).start()
+
+        return FakeKuberObject(data)
+
+    def delete(self, kind: str, namespace: str, name: str) -> None:
+        self.settings.wait('delete')
+        data = self.get(kind, namespace, name)
+
+        with self.condition:
+            self._emit(kind, namespace, 'DELETED', data)
+
+            if kind == 'deployment':
+                self._delete_pods(namespace, data)
+
+                for replica_set in self._get_replica_sets(namespace, data):
+                    self._emit('replicaset', namespace, 'DELETED', replica_set)
+
+    def _get_replica_sets(self, namespace: str, deployment: dict) -> list:
+        return [replica_set for replica_set in self.objects.get(('replicaset', namespace), {}).values()
+                if replica_set['metadata']['ownerReferences'][0]['uid'] == deployment['metadata']['uid']]
+
+    def _get_pods(self, namespace: str, deployment: dict) -> list:
+        labels: dict = deployment['spec']['template'].get('metadata', {}).get('labels', {})
+        return [pod for pod in self.objects.get(('pod', namespace), {}).values()
+                if all(pod['metadata']['labels'].get(key) == value for key, value in labels.items())]
+
+    def _delete_pods(self, namespace: str, deployment: dict, except_hash: Optional[str] = None) -> None:
+        for pod in self._get_pods(namespace, deployment):
+            if pod['metadata']['labels'].get('pod-template-hash') != except_hash:
+                self._emit('pod', namespace, 'DELETED', pod)
+
+    @staticmethod
+    def _make_replica_set(namespace: str, deployment: dict, template_hash: str) -> dict:
+        owner = {'kind': 'Deployment', 'name': deployment['metadata']['name'], 'uid': deployment['metadata']['uid']}
+
+        return {
+            'metadata': {'name': f'{deployment["metadata"]["name"]}-{template_hash}', 'namespace': namespace,
+                         'uid': str(uuid.uuid4()), 'creationTimestamp': datetime.utcnow(),
+                         'annotations': dict(deployment['metadata']['annotations']), 'ownerReferences': [owner]}
+        }
+
+    @staticmethod
+    def _make_pod(namespace: str, deployment: dict, replica_set: dict, template_hash: str, index: int,
+                  failed: bool) -> dict:
+        name = f'{deployment["metadata"]["name"]}-{template_hash}-{index}'
+        labels = {**deployment['spec']['template'].get('metadata', {}).get('labels', {}),
+                  'pod-template-hash': template_hash}
+        owner = {'kind': 'ReplicaSet', 'name': replica_set['metadata']['name'], 'uid': replica_set['metadata']['uid']}
+        now = datetime.utcnow()
+
+        if failed:
+            state = {'waiting': {'reason': 'CrashLoopBackOff', 'message': 'fake container failure'}}
+            conditions = [{'type': 'PodScheduled', 'status': 'True', 'lastTransitionTime': now}]
+        else:
+            state = {'running': {'startedAt': now}}
+            conditions = [{'type': 'PodScheduled', 'status': 'True', 'lastTransitionTime': now},
+                          {'type': 'Ready', 'status': 'True', 'lastTransitionTime': now}]
+
+        return {
+            'metadata': {'name': name, 'namespace': namespace, 'labels': labels, 'creationTimestamp': now,
+                         'ownerReferences': [owner]},
+            'status': {'phase': 'Running', 'conditions': conditions,
+                       'containerStatuses': [{'name': 'model', 'state': state}]}
+        }
+
+    def _roll_out(self, namespace: str, name: str, generation: int) -> None:
+        self.settings.wait('rollout')
+        failed = self.settings.fails('rollout')
+
+        with self.condition:
+            deployment = self.objects.get(('deployment', namespace), {}).get(name)
+
+            if deployment is None or deployment['metadata']['generation'] != generation:
+                return
+
+            replicas = deployment['spec'].get('replicas', 1)
+            template_hash = _get_digest(name, generation)[7:17]
+
+            # controller annotates Deployment and its new ReplicaSet with the same revision
+            deployment['metadata'].setdefault('annotations', {})[REVISION_ANNOTATION] = str(generation)
+            replica_set = self._make_replica_set(namespace, deployment, template_hash)
+            self._emit('replicaset', namespace, 'ADDED', replica_set)
+
+            for index in range(replicas):
+                self._emit('pod', namespace, 'ADDED', self._make_pod(namespace, deployment, replica_set,
+                                                                     template_hash, index, failed))
+
+            if not failed:
+                self._delete_pods(namespace, deployment, except_hash=template_hash)
+                deployment['status'] = {'observedGeneration': generation, 'replicas': replicas,
+                                        'updatedReplicas': replicas, 'availableReplicas': replicas}
+
+            self._emit('deployment', namespace, 'MODIFIED', deployment)
+
+    def read_daemon_set_status(self, namespace: str, name: str) -> FakeKuberObject:
+        data = self.get('daemon_set', namespace, name)
+        is_pulled = (datetime.utcnow() - data['metadata']['creationTimestamp']).total_seconds() >= \
+            self.settings.get_latency('prepull')
+
+        return FakeKuberObject({**data, 'status': {'desiredNumberScheduled': self.settings.nodes,
+                                                   'numberReady': self.settings.nodes if is_pulled else 0}})
+
+
+class FakeAppsApi:
+    def __init__(self, cluster: FakeKuberCluster) -> None:
+        self.cluster: FakeKuberCluster = cluster
+        self.api_client = FakeApiClient()
+
+    def list_namespaced_deployment(self, namespace: str, **kwargs) -> FakeKuberObject:
+        return self.cluster.list('deployment', namespace)
+
+    def create_namespaced_deployment(self, namespace: str, body: dict, **kwargs) -> FakeKuberObject:
+        return self.cluster.create('deployment', namespace, body)
+
+    def replace_namespaced_deployment(self, name: str, namespace: str, body: dict, **kwargs) -> FakeKuberObject:
+        return self.cluster.create('deployment', namespace, body, operation='replace')
+
+    def delete_namespaced_deployment(self, name: str, namespace: str, **kwargs) -> None:
+        self.cluster.delete('deployment', namespace, name)
+
+    def list_namespaced_replica_set(self, namespace: str, **kwargs) -> FakeKuberObject:
+        return self.cluster.list('replicaset', namespace)
+
+    def create_namespaced_daemon_set(self, namespace: str, body: dict, **kwargs) -> FakeKuberObject:
+        return self.cluster.create('daemon_set', namespace, body)
+
+    def read_namespaced_daemon_set_status(self, name: str, namespace: str, **kwargs) -> FakeKuberObject:
+        return self.cluster.read_daemon_set_status(namespace, name)
+
+    def delete_namespaced_daemon_set(self, name: str, namespace: str, **kwargs) -> None:
+        self.cluster.delete('daemon_set', namespace, name)
+
+
+class FakeCoreApi:
+    def __init__(self, cluster: FakeKuberCluster) -> None:
+        self.cluster: FakeKuberCluster = cluster
+        self.api_client = FakeApiClient()
+
+    def list_namespaced_service(self, namespace: str, **kwargs) -> FakeKuberObject:
+        return self.cluster.list('service', namespace)
+
+    def list_namespaced_pod(self, namespace: str, **kwargs) -> FakeKuberObject:
+        return self.cluster.list('pod', namespace)
+
+    def list_namespaced_event(self, namespace: str, **kwargs) -> FakeKuberObject:
+        return FakeKuberObject({'items': []})
+
+    def create_namespaced_service(self, namespace: str, body: dict, **kwargs) -> FakeKuberObject:
+        return self.cluster.create('service', namespace, body)
+
+    def patch_namespaced_service(self, name: str, namespace: str, body: dict, **kwargs) -> FakeKuberObject:
+        return self.cluster.create('service', namespace, body, operation='patch')
+
+    def delete_namespaced_service(self, name: str, namespace: str, **kwargs) -> None:
+        self.cluster.delete('service', namespace, name)
+
+
+class FakeWatch:
+    # watch is called with list method of fake API, kind is found by its name
+    list_methods_kinds = {
+        'list_namespaced_deployment': 'deployment',
+        'list_namespaced_replica_set': 'replicaset',
+        'list_namespaced_service': 'service',
+        'list_namespaced_pod': 'pod'
+    }
+
+    def __init__(self, cluster: FakeKuberCluster) -> None:
+        self.cluster: FakeKuberCluster = cluster
+
+    def stream(self, list_method, namespace: str, resource_version: str, timeout_seconds: float, **kwargs):
+        kind = self.list_methods_kinds[list_method.__name__]
+        return self.cluster.stream(kind, namespace, resource_version, timeout_seconds)
+
+
+class FakeKuberClients:
+    """Fake of deployer_kuber.KuberClients, all clients work with one in-memory cluster."""
+    def __init__(self, fakes_config: dict) -> None:
+        self.cluster = FakeKuberCluster(FakeSettings(fakes_config))
+        self.apps_v1_beta1_api = FakeAppsApi(self.cluster)
+        self.apps_v1_api = self.apps_v1_beta1_api
+        self.core_v1_api = FakeCoreApi(self.cluster)
+
+    def make_watch(self) -> FakeWatch:
+        return FakeWatch(self.cluster)
@@ -0,0 +1,87 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+
+class DeploymentJournal:
+    """Append-only on-disk journal of deployment stages completed for each model.
+
+    Each line is a JSON record. "start" record is written when model deployment begins and invalidates all
+    previously completed stages of this model, "complete" record stores stage completed with given inputs
+    fingerprint. Every record is flushed to disk before returning, so journal survives deployer crash. Journal is
+    compacted after each successful task, so it keeps only records of models with unfinished deployments.
+    """
+    def __init__(self, journal_path: Path):
+        self.journal_path: Path = journal_path
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _append(self, record: dict) -> None:
+        record['timestamp'] = datetime.utcnow().isoformat()
+
+        with self.journal_path.open('a') as f:
+            f.write(f'{json.dumps(record)}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_records(self) -> list:
+        records = []
+
+        if not self.journal_path.is_file():
+            return records
+
+        with self.journal_path.open('r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # last line can be partially written if deployer was killed
+                    continue
+
+        return records
+
+    def compact(self, finished_models: list) -> None:
+        """Rewrites journal without records of finished models and records invalidated by later starts."""
+        finished_models = set(finished_models)
+        models_records = {}
+
+        for record in self._read_records():
+            if record['model'] in finished_models:
+                continue
+
+            if record['event'] == 'start':
+                models_records[record['model']] = [record]
+            else:
+                models_records.setdefault(record['model'], []).append(record)
+
+        temp_journal_path = self.journal_path.with_name(f'.{self.journal_path.name}.{os.getpid()}')
+
+        with temp_journal_path.open('w') as f:
+            for records in models_records.values():
+                f.writelines([f'{json.dumps(record)}\n' for record in records])
+            f.flush()
+            os.fsync(f.fileno())
+
+        temp_journal_path.replace(self.journal_path)
+
+    def start(self, full_model_name: str, fingerprint: str) -> None:
+        self._append({'event': 'start', 'model': full_model_name, 'fingerprint': fingerprint})
+
+    def complete(self, full_model_name: str, stage_name: str, fingerprint: str, skipped: bool = False) -> None:
+        self._append({'event': 'complete',
+                      'model': full_model_name,
+                      'stage': stage_name,
+                      'fingerprint': fingerprint,
+                      'skipped': skipped})
+
+    def get_completed_stages(self) -> dict:
+        """Replays journal and returns {full model name: {stage name: fingerprint}} of completed stages."""
+        completed = {}
+
+        for record in self._read_records():
+            if record['event'] == 'start':
+                completed[record['model']] = {}
+            elif record['event'] == 'complete':
+                completed.setdefault(record['model'], {})[record['stage']] = record['fingerprint']
+
+        return completed
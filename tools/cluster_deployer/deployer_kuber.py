@@ -0,0 +1,182 @@
+import os
+import time
+from threading import Condition, Lock, Thread
+from typing import Callable, Optional
+
+from kubernetes import client as kube_client, config as kube_config, watch as kube_watch
+
+WATCH_TIMEOUT_SEC = 300
+WATCH_RETRY_INTERVAL_SEC = 1
+# Deployment revision, its ReplicaSet of the same revision is the current one
+REVISION_ANNOTATION = 'deployment.kubernetes.io/revision'
+
+
+class KuberClients:
+    """Kubernetes API clients shared by all Kubernetes stages of the process."""
+    def __init__(self):
+        kube_config.load_kube_config()
+        self.apps_v1_beta1_api = kube_client.AppsV1beta1Api()
+        self.apps_v1_api = kube_client.AppsV1Api()
+        self.core_v1_api = kube_client.CoreV1Api()
+
+    @staticmethod
+    def make_watch() -> kube_watch.Watch:
+        return kube_watch.Watch()
+
+
+class KuberObjectsCache:
+    """In-memory cache of Deployments, ReplicaSets, Services and Pods kept up to date by Kubernetes watch events.
+
+    Namespace objects of each kind are listed once on the first access, then watch thread applies changes,
+    so existence, readiness and deletion checks do not make API calls.
+    """
+    def __init__(self, clients: KuberClients):
+        self.clients: KuberClients = clients
+        self._objects: dict = {}
+        self._condition = Condition()
+        # kinds and namespaces which are being listed for the first time, so they are listed and watched once
+        self._listing: set = set()
+        self._list_methods = {
+            'deployment': self.clients.apps_v1_beta1_api.list_namespaced_deployment,
+            'replicaset': self.clients.apps_v1_api.list_namespaced_replica_set,
+            'service': self.clients.core_v1_api.list_namespaced_service,
+            'pod': self.clients.core_v1_api.list_namespaced_pod
+        }
+
+    def _relist(self, kind: str, namespace: str) -> str:
+        # list request is made without holding the lock, so readers are not blocked by API round trip
+        objects_list = self._list_methods[kind](namespace=namespace)
+
+        with self._condition:
+            self._objects[(kind, namespace)] = {item.metadata.name: item for item in objects_list.items}
+            self._condition.notify_all()
+
+        return objects_list.metadata.resource_version
+
+    def _watch(self, kind: str, namespace: str, resource_version: str) -> None:
+        while True:
+            watch = self.clients.make_watch()
+
+            try:
+                for event in watch.stream(self._list_methods[kind],
+                                          namespace=namespace,
+                                          resource_version=resource_version,
+                                          timeout_seconds=WATCH_TIMEOUT_SEC):
+                    if event['type'] == 'ERROR':
+                        # resource version is too old, cache should be rebuilt from scratch
+                        resource_version = self._relist(kind, namespace)
+                        break
+
+                    item = event['object']
+                    resource_version = item.metadata.resource_version
+
+                    with self._condition:
+                        namespace_objects: dict = self._objects[(kind, namespace)]
+                        if event['type'] == 'DELETED':
+                            namespace_objects.pop(item.metadata.name, None)
+                        else:
+                            namespace_objects[item.metadata.name] = item
+                        self._condition.notify_all()
+
+            except Exception:
+                time.sleep(WATCH_RETRY_INTERVAL_SEC)
+                try:
+                    resource_version = self._relist(kind, namespace)
+                except Exception:
+                    pass
+
+    def _ensure_watched(self, kind: str, namespace: str) -> None:
+        with self._condition:
+            # other thread lists the same objects, its result is awaited
+            self._condition.wait_for(lambda: (kind, namespace) not in self._listing)
+
+            if (kind, namespace) in self._objects:
+                return
+
+            self._listing.add((kind, namespace))
+
+        try:
+            resource_version = self._relist(kind, namespace)
+        finally:
+            with self._condition:
+                self._listing.discard((kind, namespace))
+                self._condition.notify_all()
+
+        watch_thread = Thread(target=self._watch, args=(kind, namespace, resource_version), daemon=True)
+        watch_thread.start()
+
+    def get(self, kind: str, namespace: str, name: str) -> Optional[object]:
+        self._ensure_watched(kind, namespace)
+
+        with self._condition:
+            return self._objects[(kind, namespace)].get(name)
+
+    def list(self, kind: str, namespace: str, labels: Optional[dict] = None) -> list:
+        self._ensure_watched(kind, namespace)
+        labels = labels or {}
+
+        with self._condition:
+            return [item for item in self._objects[(kind, namespace)].values()
+                    if all((item.metadata.labels or {}).get(key) == value for key, value in labels.items())]
+
+    def wait_for(self, predicate: Callable[[], bool], timeout_sec: float, watched: Optional[list] = None) -> bool:
+        """Blocks until predicate over cached objects is true or timeout expires, returns predicate value.
+
+        Predicate is called under the cache lock, so (kind, namespace) pairs it reads should be passed as watched
+        to be listed before the lock is taken.
+        """
+        for kind, namespace in watched or []:
+            self._ensure_watched(kind, namespace)
+
+        with self._condition:
+            return self._condition.wait_for(predicate, timeout=timeout_sec)
+
+    def wait_for_deleted(self, kind: str, namespace: str, name: str, timeout_sec: float) -> None:
+        if not self.wait_for(lambda: self.get(kind, namespace, name) is None, timeout_sec, [(kind, namespace)]):
+            raise TimeoutError(f'{kind} {name} was not deleted in {timeout_sec} seconds')
+
+
+# creates clients on the first use in the process, can be replaced, e.g. benchmark replaces it with fakes factory
+kuber_clients_factory: Callable[[], KuberClients] = KuberClients
+
+_clients: Optional[KuberClients] = None
+_cache: Optional[KuberObjectsCache] = None
+_pid: Optional[int] = None
+_lock = Lock()
+
+
+def _reset_after_fork() -> None:
+    """Drops clients and cache inherited by forked stage process, as cache watch threads are not inherited."""
+    global _clients, _cache, _pid
+
+    if _pid != os.getpid():
+        _clients = None
+        _cache = None
+        _pid = os.getpid()
+
+
+def get_kuber_clients() -> KuberClients:
+    """Returns Kubernetes API clients of the process, config is loaded only once."""
+    global _clients
+
+    with _lock:
+        _reset_after_fork()
+
+        if _clients is None:
+            _clients = kuber_clients_factory()
+
+    return _clients
+
+
+def get_kuber_cache() -> KuberObjectsCache:
+    """Returns Kubernetes objects cache of the process, watch threads are started on the first use."""
+    global _cache
+    clients = get_kuber_clients()
+
+    with _lock:
+        _reset_after_fork()
+
+        if _cache is None:
+            _cache = KuberObjectsCache(clients)
+
+    return _cache
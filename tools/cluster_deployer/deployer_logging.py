@@ -0,0 +1,93 @@
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler
+from pathlib import Path
+from threading import Thread
+from typing import Optional, TextIO
+
+# max log records written with one write per file
+LOG_BATCH_SIZE = 512
+
+
+class TaskLogWriter:
+    """Writes task log records to per-model log files in a separate writer thread.
+
+    Task loggers get QueueHandler, so logging from coordinator only puts record to the queue. Writer thread takes
+    all records which are already in the queue and writes them with one write and flush per file. Optionally all
+    records are also written to JSON-lines file with extended log messages as a separate field. Handlers are
+    removed from loggers and files are closed when task is finished.
+    """
+    def __init__(self, log_dir: Path, task_timestamp: str, logger_names: list, json_lines: bool = False) -> None:
+        self.log_dir: Path = log_dir
+        self.task_timestamp: str = task_timestamp
+        self.logger_names: list = logger_names
+        self.json_lines_path: Optional[Path] = log_dir / f'{task_timestamp}_task_log.jsonl' if json_lines else None
+        self.queue = queue.Queue()
+        self.handler = QueueHandler(self.queue)
+        self.handler.setLevel(logging.INFO)
+        self.formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+        self.files: dict = {}
+        self.thread = Thread(target=self._run, name='deployer-log-writer', daemon=True)
+
+    def start(self) -> None:
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.thread.start()
+
+        for logger_name in self.logger_names:
+            logger = logging.getLogger(logger_name)
+            logger.setLevel(logging.DEBUG)
+            logger.addHandler(self.handler)
+
+    def stop(self) -> None:
+        """Detaches handlers and waits until all queued records are written."""
+        for logger_name in self.logger_names:
+            logging.getLogger(logger_name).removeHandler(self.handler)
+
+        self.queue.put(None)
+        self.thread.join()
+
+    def _get_file(self, file_name: str) -> TextIO:
+        if file_name not in self.files:
+            self.files[file_name] = (self.log_dir / file_name).open('a')
+
+        return self.files[file_name]
+
+    def _write(self, records: list) -> None:
+        files_lines = {}
+
+        for record in records:
+            log_file_name = f'{self.task_timestamp}_{record.name}.log'
+            files_lines.setdefault(log_file_name, []).append(f'{self.formatter.format(record)}\n')
+
+            if self.json_lines_path is not None:
+                json_record = {'time': record.created,
+                               'logger': record.name,
+                               'level': record.levelname,
+                               'message': record.getMessage(),
+                               'extended': getattr(record, 'extended_log_message', '')}
+                files_lines.setdefault(self.json_lines_path.name, []).append(f'{json.dumps(json_record)}\n')
+
+        for file_name, lines in files_lines.items():
+            f = self._get_file(file_name)
+            f.write(''.join(lines))
+            f.flush()
+
+    def _run(self) -> None:
+        is_stopped = False
+
+        try:
+            while not is_stopped:
+                records = [self.queue.get()]
+
+                while len(records) < LOG_BATCH_SIZE:
+                    try:
+                        records.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                is_stopped = None in records
+                self._write([record for record in records if record is not None])
+        finally:
+            for f in self.files.values():
+                f.close()
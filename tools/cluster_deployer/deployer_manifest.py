@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Tuple
+
+
+class FilesManifest:
+    """Per-model manifest of rendered deployment files: target dir -> {relative path: [contents hash, mtime]}.
+
+    Rendered files are synced to target dirs by writing only files with changed contents and deleting only
+    files which are not rendered anymore, so unchanged files keep their modification times. File is rewritten
+    if its modification time differs from the recorded one, e.g. it was edited by hand.
+    """
+    def __init__(self, manifest_path: Path):
+        self.manifest_path: Path = manifest_path
+
+        try:
+            with self.manifest_path.open('r') as f:
+                self.entries: dict = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def has_dir(self, target_dir: Path) -> bool:
+        return str(target_dir) in self.entries
+
+    def sync(self, target_dir: Path, files: dict) -> Tuple[list, list]:
+        """Syncs files {relative path: contents} to target dir, returns lists of written and deleted files."""
+        old_entries: dict = self.entries.get(str(target_dir), {})
+        new_entries = {}
+        written = []
+        deleted = []
+
+        for file_name, contents in files.items():
+            file_path = target_dir / file_name
+            file_hash = hashlib.sha256(contents).hexdigest()
+            old_hash, old_mtime_ns = old_entries.get(file_name, (None, None))
+
+            try:
+                is_unchanged = old_hash == file_hash and file_path.stat().st_mtime_ns == old_mtime_ns
+            except OSError:
+                is_unchanged = False
+
+            if not is_unchanged:
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                file_path.write_bytes(contents)
+                written.append(file_name)
+
+            new_entries[file_name] = (file_hash, file_path.stat().st_mtime_ns)
+
+        for file_name in old_entries.keys() - files.keys():
+            file_path = target_dir / file_name
+
+            if file_path.is_file():
+                file_path.unlink()
+                deleted.append(file_name)
+
+            # remove directories left empty
+            for parent in file_path.relative_to(target_dir).parents:
+                parent_path = target_dir / parent
+                if parent_path == target_dir or not parent_path.is_dir() or any(parent_path.iterdir()):
+                    break
+                parent_path.rmdir()
+
+        self.entries[str(target_dir)] = new_entries
+
+        return sorted(written), sorted(deleted)
+
+    def save(self) -> None:
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_manifest_path = self.manifest_path.with_name(f'.{self.manifest_path.name}.{os.getpid()}')
+
+        with temp_manifest_path.open('w') as f:
+            json.dump(self.entries, f, indent=2)
+
+        temp_manifest_path.replace(self.manifest_path)
@@ -0,0 +1,219 @@
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+from deployer_stages import DeploymentStatus
+
+# stages take from seconds (kuber entities handling) to tens of minutes (images building and pushing)
+STAGE_TIME_BUCKETS = (0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(label_names: tuple, label_values: tuple) -> str:
+    if not label_names:
+        return ''
+
+    labels = ','.join([f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)])
+
+    return f'{{{labels}}}'
+
+
+def format_value(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class Metric:
+    """Metric family in Prometheus text exposition format with values kept per label values tuple."""
+    metric_type = None
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: tuple = label_names
+        self.values: dict = {}
+
+    def _get_samples(self) -> list:
+        """Returns list of (sample name suffix, label names, label values, value) tuples."""
+        return [('', self.label_names, label_values, value) for label_values, value in sorted(self.values.items())]
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+
+        for suffix, label_names, label_values, value in self._get_samples():
+            lines.append(f'{self.name}{suffix}{format_labels(label_names, label_values)} {format_value(value)}')
+
+        return lines
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def set(self, *label_values, value: float) -> None:
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (),
+                 buckets: tuple = STAGE_TIME_BUCKETS) -> None:
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self.buckets: tuple = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, *label_values, value: float) -> None:
+        if label_values not in self.values:
+            self.values[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+
+        histogram = self.values[label_values]
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                histogram['buckets'][i] += 1
+
+    def _get_samples(self) -> list:
+        samples = []
+        bucket_label_names = self.label_names + ('le',)
+
+        for label_values, histogram in sorted(self.values.items()):
+            for bucket, bucket_count in zip(self.buckets, histogram['buckets']):
+                samples.append(('_bucket', bucket_label_names, label_values + (format_value(bucket),), bucket_count))
+
+            samples.append(('_sum', self.label_names, label_values, histogram['sum']))
+            samples.append(('_count', self.label_names, label_values, histogram['count']))
+
+        return samples
+
+
+class DeployerMetrics:
+    """Deployer metrics collected by coordinator from dispatched and returned deployment statuses.
+
+    Metrics are exported in Prometheus text format to node exporter textfile collector file and/or to Pushgateway,
+    both are disabled if not set in metrics config:
+
+        metrics:
+          textfile_path: "/var/lib/node_exporter/textfile/cluster_deployer.prom"
+          pushgateway_url: "http://pushgateway:9091"
+          job: "cluster_deployer"
+          export_interval_sec: 15
+    """
+    def __init__(self, metrics_config: Optional[dict]) -> None:
+        metrics_config = metrics_config or {}
+        textfile_path = metrics_config.get('textfile_path')
+        self.textfile_path: Optional[Path] = Path(textfile_path).expanduser() if textfile_path else None
+        self.pushgateway_url: Optional[str] = metrics_config.get('pushgateway_url') or None
+        self.job: str = metrics_config.get('job', 'cluster_deployer')
+        self.export_interval_sec: float = metrics_config.get('export_interval_sec', 15)
+        self.last_export_time: float = 0.0
+        # deployment statuses which were put to stage queues and were not returned yet, per stage
+        self.dispatched: dict = defaultdict(int)
+
+        self.stage_duration = Histogram('deployer_stage_duration_seconds',
+                                        'Time of stage action, from taking model from stage queue to returning it',
+                                        ('stage', 'pipeline'))
+        self.queue_wait = Histogram('deployer_stage_queue_wait_seconds',
+                                    'Time model spent in stage queue before it was taken by stage worker',
+                                    ('stage', 'pipeline'))
+        self.queue_depth = Gauge('deployer_stage_queue_depth',
+                                 'Models waiting in stage queue', ('stage',))
+        self.in_flight = Gauge('deployer_stage_in_flight',
+                               'Models dispatched to stage and not returned yet, both queued and processed',
+                               ('stage',))
+        self.stages_completed = Counter('deployer_stages_completed_total',
+                                        'Stages completed successfully', ('stage', 'pipeline'))
+        self.failures = Counter('deployer_failures_total',
+                                'Models deployments failed at stage', ('model', 'pipeline', 'stage'))
+        self.models_deployed = Counter('deployer_models_deployed_total',
+                                       'Models deployed with all pipeline stages', ('pipeline',))
+        self.last_export = Gauge('deployer_last_export_timestamp_seconds',
+                                 'Unix time of the last metrics export')
+
+        self.metrics = [self.stage_duration, self.queue_wait, self.queue_depth, self.in_flight,
+                        self.stages_completed, self.failures, self.models_deployed, self.last_export]
+
+    @property
+    def enabled(self) -> bool:
+        return self.textfile_path is not None or self.pushgateway_url is not None
+
+    def observe_dispatch(self, stage_name: str) -> None:
+        self.dispatched[stage_name] += 1
+        self.in_flight.set(stage_name, value=self.dispatched[stage_name])
+
+    def observe_result(self, deployment_status: DeploymentStatus, pipeline_name: str) -> None:
+        stage_name = deployment_status.current_stage
+        self.dispatched[stage_name] -= 1
+        self.in_flight.set(stage_name, value=self.dispatched[stage_name])
+
+        if deployment_status.start_time is not None:
+            self.queue_wait.observe(stage_name, pipeline_name,
+                                    value=deployment_status.start_time - deployment_status.enqueue_time)
+            self.stage_duration.observe(stage_name, pipeline_name,
+                                        value=deployment_status.end_time - deployment_status.start_time)
+
+        if deployment_status.finish:
+            self.failures.inc(deployment_status.full_model_name, pipeline_name, stage_name)
+        else:
+            self.stages_completed.inc(stage_name, pipeline_name)
+
+            if not deployment_status.pipeline:
+                self.models_deployed.inc(pipeline_name)
+
+    def update_queue_depths(self, in_queues: dict) -> None:
+        for stage_name, in_queue in in_queues.items():
+            try:
+                depth = in_queue.qsize()
+            except NotImplementedError:
+                # multiprocessing queue size is not available on macOS, queued and processed models are counted
+                depth = self.dispatched[stage_name]
+
+            self.queue_depth.set(stage_name, value=depth)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+    def is_export_due(self) -> bool:
+        return self.enabled and time.monotonic() - self.last_export_time >= self.export_interval_sec
+
+    def export(self, in_queues: dict) -> None:
+        """Writes metrics to textfile and pushes them to Pushgateway, requests errors are OSError subclasses."""
+        if not self.enabled:
+            return
+
+        self.last_export_time = time.monotonic()
+        self.update_queue_depths(in_queues)
+        self.last_export.set(value=time.time())
+        metrics_text = self.render()
+
+        if self.textfile_path is not None:
+            # textfile collector can read file at any moment, so it is replaced atomically
+            self.textfile_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_textfile_path = self.textfile_path.with_name(f'.{self.textfile_path.name}.{os.getpid()}')
+            temp_textfile_path.write_text(metrics_text)
+            temp_textfile_path.replace(self.textfile_path)
+
+        if self.pushgateway_url is not None:
+            # PUT replaces all metrics of the job group, so metrics of the previous run are not mixed in
+            response = requests.put(f'{self.pushgateway_url.rstrip("/")}/metrics/job/{self.job}',
+                                    data=metrics_text.encode('utf-8'),
+                                    headers={'Content-Type': 'text/plain; version=0.0.4'},
+                                    timeout=10)
+            response.raise_for_status()
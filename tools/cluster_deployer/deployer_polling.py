@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Callable, Optional, Tuple
+
+PROBE_WORKERS_NUM = 8
+
+PollingStats = namedtuple('PollingStats', ['attempts', 'polling_time'])
+
+
+class PollingCancelledError(Exception):
+    pass
+
+
+class PollingTask:
+    """Single probe polled by Poller until estimator accepts probe result, deadline expires or task is cancelled.
+
+    Interval between attempts is multiplied by backoff after each failed attempt up to max interval,
+    jitter is a fraction of the interval which is randomly added or subtracted.
+    """
+    def __init__(self, probe: Callable, estimator: Callable, interval_sec: float, timeout_sec: float,
+                 backoff: float = 1.0, max_interval_sec: Optional[float] = None, jitter: float = 0.0) -> None:
+        self.probe: Callable = probe
+        self.estimator: Callable = estimator
+        self.interval_sec: float = interval_sec
+        self.backoff: float = backoff
+        self.max_interval_sec: float = max_interval_sec or interval_sec
+        self.jitter: float = jitter
+
+        self.start_time: float = time.monotonic()
+        self.deadline: float = self.start_time + timeout_sec
+        self.attempts: int = 0
+        self.result: Any = None
+        self.success_time: Optional[float] = None
+        self.timed_out: bool = False
+        self.cancelled: bool = False
+        self._done = Event()
+        # task is finished once: by accepted attempt, by deadline or by cancel, whichever comes first
+        self._finish_lock = Lock()
+
+    def next_delay(self) -> float:
+        delay = min(self.interval_sec * self.backoff ** max(self.attempts - 1, 0), self.max_interval_sec)
+        return max(delay * (1 + random.uniform(-self.jitter, self.jitter)), 0)
+
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+    def finish(self, result: Any = None, timed_out: bool = False, cancelled: bool = False) -> bool:
+        """Finishes task with accepted result, by timeout or by cancel, returns False if it was finished before."""
+        with self._finish_lock:
+            if self._done.is_set():
+                return False
+
+            if timed_out:
+                self.timed_out = True
+            elif cancelled:
+                self.cancelled = True
+            else:
+                self.result = result
+                self.success_time = time.monotonic()
+
+            self._done.set()
+
+        return True
+
+    def cancel(self) -> None:
+        self.finish(cancelled=True)
+
+    def get_stats(self) -> PollingStats:
+        end_time = self.success_time or time.monotonic()
+        return PollingStats(attempts=self.attempts, polling_time=timedelta(seconds=end_time - self.start_time))
+
+    def wait(self) -> Tuple[Any, PollingStats]:
+        """Blocks until task is finished or its deadline expires, returns accepted probe result and polling stats.
+
+        Waiting does not depend on scheduler and probe threads, so hung probe does not block waiter past deadline.
+        """
+        if not self._done.wait(timeout=max(self.deadline - time.monotonic(), 0)):
+            self.finish(timed_out=True)
+
+        if self.cancelled:
+            raise PollingCancelledError(f'Polling was cancelled after {self.attempts} attempts')
+
+        if self.timed_out:
+            raise TimeoutError(f'Polling timed out after {self.attempts} attempts')
+
+        return self.result, self.get_stats()
+
+
+class Poller:
+    """Polling engine shared by all probes of the process.
+
+    Single scheduler thread keeps tasks in a heap ordered by next attempt time and hands due probes
+    to a small thread pool, so number of threads does not depend on number of polled probes or attempts.
+    """
+    def __init__(self, probe_workers_num: int = PROBE_WORKERS_NUM) -> None:
+        self._heap: list = []
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self.probe_workers_num: int = probe_workers_num
+        self._executor = ThreadPoolExecutor(max_workers=probe_workers_num)
+        self._scheduler = Thread(target=self._schedule, daemon=True)
+        self._scheduler.start()
+
+    def _push(self, task: PollingTask, delay: float) -> None:
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), task))
+            self._condition.notify()
+
+    def _schedule(self) -> None:
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+
+                _, _, task = heapq.heappop(self._heap)
+
+            if task.is_done():
+                continue
+
+            if time.monotonic() >= task.deadline:
+                task.finish(timed_out=True)
+                continue
+
+            self._executor.submit(self._attempt, task)
+
+    def ensure_probe_workers(self, probe_workers_num: int) -> None:
+        """Grows probe thread pool, probes which are already running finish in the old pool."""
+        with self._condition:
+            if probe_workers_num <= self.probe_workers_num:
+                return
+
+            old_executor = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=probe_workers_num)
+            self.probe_workers_num = probe_workers_num
+
+        old_executor.shutdown(wait=False)
+
+    def _attempt(self, task: PollingTask) -> None:
+        task.attempts += 1
+
+        try:
+            result = task.probe()
+            accepted = bool(result) and task.estimator(result)
+        except Exception:
+            result, accepted = None, False
+
+        if task.is_done():
+            return
+
+        if accepted:
+            task.finish(result)
+        else:
+            # next attempt is not scheduled past deadline, deadline is checked by scheduler
+            self._push(task, min(task.next_delay(), max(task.deadline - time.monotonic(), 0)))
+
+    def submit(self, probe: Callable, estimator: Callable, interval_sec: float, timeout_sec: float,
+               backoff: float = 1.0, max_interval_sec: Optional[float] = None, jitter: float = 0.0,
+               first_delay_sec: Optional[float] = None) -> PollingTask:
+        """Schedules probe polling, first attempt is made after first delay (polling interval by default)."""
+        task = PollingTask(probe, estimator, interval_sec, timeout_sec, backoff, max_interval_sec, jitter)
+        self._push(task, interval_sec if first_delay_sec is None else first_delay_sec)
+        return task
+
+
+_poller: Optional[Poller] = None
+_poller_pid: Optional[int] = None
+_lock = Lock()
+
+
+def get_poller(probe_workers_num: int = PROBE_WORKERS_NUM) -> Poller:
+    """Returns polling engine of the process with at least given probe workers number.
+
+    Scheduler thread is started on the first use.
+    """
+    global _poller, _poller_pid
+
+    with _lock:
+        # threads are not inherited by forked stage processes, so each process starts its own poller
+        if _poller is None or _poller_pid != os.getpid():
+            _poller = Poller(probe_workers_num)
+            _poller_pid = os.getpid()
+        else:
+            _poller.ensure_probe_workers(probe_workers_num)
+
+    return _poller
@@ -1,27 +1,55 @@
-import shutil
 import logging
 import sys
 import yaml
 import json
+import re
+import time
 from traceback import format_exception
-from typing import Optional
+from typing import Callable, Optional, Tuple, Iterable
 from enum import Enum
 from collections import namedtuple
+from copy import deepcopy
+from datetime import datetime
 from pathlib import Path
 from abc import ABCMeta, abstractmethod
-from multiprocessing import Process, Queue
+from multiprocessing import Queue
 
 import requests
 from docker import DockerClient
 from docker.models.containers import Container
-from docker.errors import ImageNotFound, NotFound
-from kubernetes import client as kube_client, config as kube_config
-
-from deployer_utils import safe_delete_path, fill_placeholders_from_dict, poll
+from docker.errors import ImageNotFound, NotFound, APIError, BuildError
+from docker.utils import parse_repository_tag
+from kubernetes import client as kube_client
+from kubernetes.client.rest import ApiException
+
+from deployer_utils import safe_delete_path, render_template_files
+from deployer_build_cache import BUILD_FINGERPRINT_LABEL, get_build_fingerprint, get_files_fingerprint, \
+    make_build_context, ImageBuildIndex
+from deployer_manifest import FilesManifest
+from deployer_kuber import KuberObjectsCache, get_kuber_clients, get_kuber_cache, REVISION_ANNOTATION
+from deployer_polling import Poller, get_poller, PROBE_WORKERS_NUM
 
 LogMessage = namedtuple('LogMessage', ['full_model_name', 'log_level', 'log_message', 'extended_log_message'])
 KuberEntityData = namedtuple('KuberEntityData', ['name', 'namespace', 'config'])
 
+# model loading takes from seconds to minutes, so model API probes are backed off
+MODEL_PROBE_BACKOFF = {'backoff': 1.5, 'max_interval_sec': 5, 'jitter': 0.1}
+# single model API request should not take whole polling timeout if model hangs on the request
+MODEL_PROBE_REQUEST_TIMEOUT_SEC = 30
+
+
+def make_docker_client(config: dict) -> DockerClient:
+    return DockerClient(base_url=config['docker_base_url'])
+
+
+def make_http_session(config: dict) -> requests.Session:
+    return requests.Session()
+
+
+# stage clients factories get stage config, they can be replaced, e.g. benchmark replaces them with fakes factories
+docker_client_factory: Callable[[dict], DockerClient] = make_docker_client
+http_session_factory: Callable[[dict], requests.Session] = make_http_session
+
 
 class LogLevel(Enum):
     INFO = logging.INFO
@@ -32,63 +60,270 @@ class DeploymentStatus:
     def __init__(self, full_model_name: str, pipeline: list):
         self.full_model_name: str = full_model_name
         self.pipeline: list = pipeline
+        self.current_stage: Optional[str] = None
         self.finish: bool = False
         self.extended_stage_info: str = ''
+        self.build_fingerprint: Optional[str] = None
+        # image with the same build fingerprint is already in the cluster registry
+        self.image_cached: bool = False
+        # build context files {relative path: contents} if deployment files are made in memory
+        self.build_files: Optional[dict] = None
+        # paths of deployment files written or deleted by make files stage
+        self.changed_files: Optional[list] = None
+        # current stage timestamps: put to stage queue, taken by stage worker, returned by stage worker
+        self.enqueue_time: Optional[float] = None
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+
+def get_buildargs(model_config: dict) -> dict:
+    # TODO: think how to get rid of hardcode buildargs
+    buildarg_keys = ['BASE_IMAGE', 'COMMIT', 'CONFIG', 'RUN_CMD', 'FULL_MODEL_NAME']
+    buildargs = {key: model_config.get(key, '') for key in buildarg_keys}
+    dumped_args = json.dumps(model_config['MODEL_ARGS'])
+    # TODO: find out how to get rid of the replacement
+    dumped_args = dumped_args.replace('"', '\\"').replace('[', '\\[').replace(']', '\\]')
+    buildargs['MODEL_ARGS'] = dumped_args
+
+    return buildargs
+
+
+def render_model_files(config: dict, model_config: dict) -> Tuple[dict, dict]:
+    """Returns model build context files and Kubernetes manifests rendered from model template."""
+    files = render_template_files(config['paths']['templates_dir'] / model_config['TEMPLATE'], model_config)
+    kuber_file_names = {model_config['KUBER_DP_FILE'], model_config['KUBER_LB_FILE']}
+    build_files = {name: contents for name, contents in files.items() if name not in kuber_file_names}
+    kuber_files = {name: contents for name, contents in files.items() if name in kuber_file_names}
+
+    return build_files, kuber_files
+
+
+def get_build_files(config: dict, deployment_status: DeploymentStatus) -> Optional[dict]:
+    """Returns in-memory build context files if deployment files are made in memory, otherwise None.
+
+    Files are rendered again if make files stage was not run in this deployment.
+    """
+    if not config['make_files_in_memory']:
+        return None
+
+    if deployment_status.build_files is None:
+        model_config = config['models'][deployment_status.full_model_name]
+        deployment_status.build_files, _ = render_model_files(config, model_config)
+
+    return deployment_status.build_files
+
+
+class LayerProgressTracker:
+    """Keeps per-layer state of docker push/pull progress stream instead of the whole server response."""
+    progress_statuses = {'Pushing', 'Downloading'}
+    transferred_statuses = {'Pushed', 'Pull complete'}
+    skipped_statuses = {'Layer already exists', 'Already exists'}
+    layer_statuses = progress_statuses | transferred_statuses | skipped_statuses | \
+        {'Preparing', 'Waiting', 'Pulling fs layer', 'Verifying Checksum', 'Download complete', 'Extracting'}
+
+    def __init__(self):
+        self.layers: dict = {}
+        self.digest: Optional[str] = None
+        self.start_time: float = time.monotonic()
+        self.last_progress_time: float = self.start_time
+
+    def update(self, chunk: dict) -> None:
+        if 'error' in chunk:
+            raise APIError(chunk['error'])
+
+        status: str = chunk.get('status', '')
+        self.digest = chunk.get('aux', {}).get('Digest', self.digest)
+
+        if status.startswith('Digest: '):
+            self.digest = status[len('Digest: '):]
+
+        if 'id' not in chunk or not (status in self.layer_statuses or status.startswith('Mounted from')):
+            return
+
+        now = time.monotonic()
+        layer = self.layers.setdefault(chunk['id'], {'status': status, 'current': 0, 'total': 0,
+                                                     'start_time': now, 'end_time': None})
+        layer['status'] = status
+
+        if status in self.progress_statuses:
+            progress_detail: dict = chunk.get('progressDetail') or {}
+            layer['current'] = progress_detail.get('current', layer['current'])
+            layer['total'] = progress_detail.get('total', layer['total']) or layer['total']
+        elif status in self.transferred_statuses:
+            layer['current'] = layer['total']
+            layer['end_time'] = now
+        elif status in self.skipped_statuses or status.startswith('Mounted from'):
+            layer['end_time'] = now
 
+    def is_progress_due(self, interval_sec: float) -> bool:
+        now = time.monotonic()
+
+        if now - self.last_progress_time >= interval_sec:
+            self.last_progress_time = now
+            return True
+
+        return False
+
+    def _count(self) -> Tuple[int, int, float]:
+        transferred = len([layer for layer in self.layers.values() if layer['status'] in self.transferred_statuses])
+        skipped = len([layer for layer in self.layers.values() if layer['end_time'] and
+                       layer['status'] not in self.transferred_statuses])
+        transferred_mb = sum([layer['current'] for layer in self.layers.values()]) / 2 ** 20
+
+        return transferred, skipped, transferred_mb
+
+    def get_progress(self) -> str:
+        transferred, skipped, transferred_mb = self._count()
+        total_mb = sum([layer['total'] for layer in self.layers.values()]) / 2 ** 20
+
+        return f'layers done: {transferred + skipped}/{len(self.layers)}, ' \
+               f'transferred: {transferred_mb:.1f}/{total_mb:.1f} MB'
+
+    def get_summary(self) -> str:
+        transferred, skipped, transferred_mb = self._count()
+        elapsed_time = time.monotonic() - self.start_time
+        throughput = transferred_mb / elapsed_time if elapsed_time > 0 else 0
+
+        layer_durations = [layer['end_time'] - layer['start_time'] for layer in self.layers.values()
+                           if layer['status'] in self.transferred_statuses]
+        slowest_layer = f'{max(layer_durations):.1f}s' if layer_durations else '-'
+
+        return f'layers transferred: {transferred}, layers skipped: {skipped}, ' \
+               f'transferred: {transferred_mb:.1f} MB in {elapsed_time:.1f}s, throughput: {throughput:.1f} MB/s, ' \
+               f'slowest layer: {slowest_layer}, digest: {self.digest}'
+
+
+class AbstractDeploymentStage(metaclass=ABCMeta):
+    """Deployment stage worker, processes deployment statuses from in_queue until None is received.
+
+    Worker is run by stage executor in a process, a thread or an event loop, see deployer_executors.
+    """
+    # stage waits on probes of process polling engine, deployer sizes probe pool by workers of such stages
+    uses_poller: bool = False
 
-class AbstractDeploymentStage(Process, metaclass=ABCMeta):
     def __init__(self, config: dict, stage_name: str, in_queue: Queue, out_queue: Queue):
-        super(AbstractDeploymentStage, self).__init__()
         self.config = config
         self.stage_name: str = stage_name
         self.in_queue: Queue = in_queue
         self.out_queue: Queue = out_queue
         self.container: Optional[Container] = None
         self.extended_log_message = ''
+        self._docker_client: Optional[DockerClient] = None
+        self._http_session: Optional[requests.Session] = None
+
+    # clients are created in the worker on the first use, so workers which do not need them do not connect
+    @property
+    def docker_client(self) -> DockerClient:
+        if self._docker_client is None:
+            self._docker_client = docker_client_factory(self.config)
+
+        return self._docker_client
+
+    @property
+    def http_session(self) -> requests.Session:
+        if self._http_session is None:
+            self._http_session = http_session_factory(self.config)
+
+        return self._http_session
+
+    @property
+    def poller(self) -> Poller:
+        return get_poller(self.config.get('probe_workers_num', PROBE_WORKERS_NUM))
+
+    def _probe_model_api(self, url: str, payload: dict, timeout_sec: float,
+                         first_delay_sec: Optional[float] = None) -> tuple:
+        """Polls model API until it responds with 200, returns (response JSON, polling stats)."""
+        # first attempt can be made before submit returns, so probe does not refer to the task
+        deadline = time.monotonic() + timeout_sec
+
+        polling_task = self.poller.submit(
+            probe=lambda: self.http_session.post(
+                url=url,
+                json=payload,
+                timeout=min(MODEL_PROBE_REQUEST_TIMEOUT_SEC, max(deadline - time.monotonic(), 0.1))),
+            estimator=lambda result: result.status_code == 200,
+            interval_sec=1,
+            timeout_sec=timeout_sec,
+            first_delay_sec=first_delay_sec,
+            **MODEL_PROBE_BACKOFF)
+
+        polling_result, polling_stats = polling_task.wait()
+
+        return polling_result.json(), polling_stats
+
+    def _log(self, full_model_name: str, log_message: str, extended_log_message: str = '',
+             log_level: LogLevel = LogLevel.INFO) -> None:
+        log_message = LogMessage(full_model_name=full_model_name,
+                                 log_level=log_level,
+                                 log_message=f'[{full_model_name}] [{self.stage_name}]: {log_message}',
+                                 extended_log_message=extended_log_message)
+
+        self.out_queue.put(log_message)
+
+    def _track_layers(self, full_model_name: str, response_generator: Iterable) -> LayerProgressTracker:
+        """Consumes decoded docker push/pull stream with periodical compact progress logging."""
+        tracker = LayerProgressTracker()
+
+        for chunk in response_generator:
+            tracker.update(chunk)
+
+            if tracker.is_progress_due(self.config['progress_log_interval_sec']):
+                self._log(full_model_name, f'progress: {tracker.get_progress()}')
+
+        return tracker
 
     def run(self) -> None:
         while True:
-            deployment_status: DeploymentStatus = self.in_queue.get()
-            full_model_name = deployment_status.full_model_name
+            deployment_status: Optional[DeploymentStatus] = self.in_queue.get()
 
-            try:
-                log_message = LogMessage(full_model_name=full_model_name,
-                                         log_level=LogLevel.INFO,
-                                         log_message=f'[{full_model_name}] [{self.stage_name}]: stage started',
-                                         extended_log_message='')
-
-                self.out_queue.put(log_message)
-
-                out_log_level = LogLevel.INFO
-                out_log_message = f'[{full_model_name}] [{self.stage_name}]: stage finished'
-                deployment_status: DeploymentStatus = self._act(deployment_status)
-                out_extended_log_message = deployment_status.extended_stage_info.strip().strip(';').strip()
-                deployment_status.extended_stage_info = ''
-
-            except Exception:
-                deployment_status.finish = True
-                exc_type, exc_value, exc_tb = sys.exc_info()
-                tr = '\t{}'.format('\n\t'.join(format_exception(exc_type, exc_value, exc_tb)))
-
-                out_log_level = LogLevel.ERROR
-                out_log_message = f'[{full_model_name}] [{self.stage_name}]: error occurred during stage:\n{tr}'
-                out_extended_log_message = ''
-
-                if self.container:
-                    try:
-                        self.container.stop()
-                    except NotFound:
-                        pass
-                    finally:
-                        self.container = None
+            if deployment_status is None:
+                break
 
+            self.process(deployment_status)
+
+    def process(self, deployment_status: DeploymentStatus) -> None:
+        deployment_status.start_time = time.time()
+        full_model_name = deployment_status.full_model_name
+
+        try:
             log_message = LogMessage(full_model_name=full_model_name,
-                                     log_level=out_log_level,
-                                     log_message=out_log_message,
-                                     extended_log_message=out_extended_log_message)
+                                     log_level=LogLevel.INFO,
+                                     log_message=f'[{full_model_name}] [{self.stage_name}]: stage started',
+                                     extended_log_message='')
 
             self.out_queue.put(log_message)
-            self.out_queue.put(deployment_status)
+
+            out_log_level = LogLevel.INFO
+            out_log_message = f'[{full_model_name}] [{self.stage_name}]: stage finished'
+            deployment_status: DeploymentStatus = self._act(deployment_status)
+            out_extended_log_message = deployment_status.extended_stage_info.strip().strip(';').strip()
+            deployment_status.extended_stage_info = ''
+
+        except Exception:
+            deployment_status.finish = True
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            tr = '\t{}'.format('\n\t'.join(format_exception(exc_type, exc_value, exc_tb)))
+
+            out_log_level = LogLevel.ERROR
+            out_log_message = f'[{full_model_name}] [{self.stage_name}]: error occurred during stage:\n{tr}'
+            out_extended_log_message = ''
+
+            if self.container:
+                try:
+                    self.container.stop()
+                except NotFound:
+                    pass
+                finally:
+                    self.container = None
+
+        log_message = LogMessage(full_model_name=full_model_name,
+                                 log_level=out_log_level,
+                                 log_message=out_log_message,
+                                 extended_log_message=out_extended_log_message)
+
+        self.out_queue.put(log_message)
+        deployment_status.end_time = time.time()
+        self.out_queue.put(deployment_status)
 
     @abstractmethod
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
@@ -100,69 +335,40 @@ class MakeFilesDeploymentStage(AbstractDeploymentStage):
         stage_name = 'make deployment files'
         super(MakeFilesDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
 
-    def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
-        def get_dir_files_recursive(path: Path) -> list:
-            files_list = []
-            for item in path.iterdir():
-                if item.is_dir():
-                    files_list.extend(get_dir_files_recursive(item))
-                else:
-                    files_list.append(item)
-            return files_list
+    def _sync_files(self, manifest: FilesManifest, target_dir: Path, files: dict) -> list:
+        """Writes changed and deletes stale files in target dir, returns changed files paths."""
+        if not manifest.has_dir(target_dir):
+            # files made before manifest was kept are not tracked, so directory is rebuilt from scratch
+            safe_delete_path(target_dir)
+
+        target_dir.mkdir(parents=True, exist_ok=True)
+        written, deleted = manifest.sync(target_dir, files)
+
+        return [str(target_dir / file_name) for file_name in written + deleted]
 
+    def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
         model_config = self.config['models'][deployment_status.full_model_name]
-        temp_dir = self.config['paths']['temp_dir']
-        templates_dir = self.config['paths']['templates_dir']
-        kuber_configs_dir = self.config['paths']['kuber_configs_dir']
-        models_dir = self.config['paths']['models_dir']
-
-        deploy_files_dir = Path(temp_dir, f'{model_config["FULL_MODEL_NAME"]}').resolve()
-        safe_delete_path(deploy_files_dir)
-        shutil.copytree(templates_dir / model_config['TEMPLATE'], deploy_files_dir)
-        deploy_files = get_dir_files_recursive(deploy_files_dir)
-
-        for deploy_file in deploy_files:
-            with open(deploy_file, 'r') as f:
-                file = f.read()
-            file = fill_placeholders_from_dict(file, model_config)
-            with open(deploy_file, 'w') as f:
-                f.write(file)
-
-        run_model_file = Path(deploy_files_dir, 'run_model.sh')
-        if run_model_file.is_file():
-            run_model_file.rename(deploy_files_dir / model_config['RUN_FILE'])
-
-        dockerignore_file = Path(deploy_files_dir, 'dockerignore')
-        if dockerignore_file.is_file():
-            dockerignore_file.rename(deploy_files_dir / '.dockerignore')
-
-        # move Kubernetes configs
-        kuber_config_path = kuber_configs_dir / model_config['FULL_MODEL_NAME']
-        if kuber_config_path.is_dir() and not kuber_config_path.samefile('/'):
-            shutil.rmtree(kuber_config_path, ignore_errors=True)
-        kuber_config_path.mkdir(parents=True, exist_ok=True)
-
-        kuber_dp_file = Path(deploy_files_dir, 'kuber_dp.yaml')
-        if kuber_dp_file.is_file():
-            kuber_dp_file.rename(deploy_files_dir / model_config['KUBER_DP_FILE'])
-            Path(deploy_files_dir / model_config['KUBER_DP_FILE']).rename(
-                kuber_config_path / model_config['KUBER_DP_FILE'])
-
-        kuber_lb_file = Path(deploy_files_dir, 'kuber_lb.yaml')
-        if kuber_lb_file.is_file():
-            kuber_lb_file.rename(deploy_files_dir / model_config['KUBER_LB_FILE'])
-            Path(deploy_files_dir / model_config['KUBER_LB_FILE']).rename(
-                kuber_config_path / model_config['KUBER_LB_FILE'])
-
-        # move model building files
-        model_path = models_dir / model_config['FULL_MODEL_NAME']
-        safe_delete_path(model_path)
-        deploy_files_dir.rename(model_path)
-
-        if model_config['serialize_config']:
-            model_config_path: Path = model_path / 'deployment_config.json'
-            with model_config_path.open('w') as f:
-                json.dump(model_config, f, indent=2)
+        full_model_name = model_config['FULL_MODEL_NAME']
+        manifest = FilesManifest(self.config['paths']['manifests_dir'] / f'{full_model_name}.json')
+
+        build_files, kuber_files = render_model_files(self.config, model_config)
+        changed_files = self._sync_files(manifest, self.config['paths']['kuber_configs_dir'] / full_model_name,
+                                         kuber_files)
+
+        if self.config['make_files_in_memory']:
+            # build files are passed to docker build as tar context
+            deployment_status.build_files = build_files
+        else:
+            changed_files += self._sync_files(manifest, self.config['paths']['models_dir'] / full_model_name,
+                                              build_files)
+
+        manifest.save()
+
+        deployment_status.changed_files = changed_files
+        changed_files_info = ', '.join(changed_files) if changed_files else 'no changes'
+        files_location = 'in memory' if self.config['make_files_in_memory'] else 'on disk'
+        deployment_status.extended_stage_info = f'build files made {files_location}, ' \
+                                                f'changed files: {changed_files_info}'
 
         return deployment_status
 
@@ -171,13 +377,43 @@ class DeleteImageDeploymentStage(AbstractDeploymentStage):
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'delete docker image'
         super(DeleteImageDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
-        self.docker_client: DockerClient = DockerClient(base_url=config['docker_base_url'])
+        self.build_index = ImageBuildIndex(config['paths']['build_index_dir'])
+
+    def _is_image_cached(self, image_tag: str, fingerprint: str) -> bool:
+        index_entry = self.build_index.get(image_tag)
+
+        if not index_entry or index_entry['fingerprint'] != fingerprint:
+            return False
+
+        try:
+            registry_digest = self.docker_client.images.get_registry_data(image_tag).id
+        except APIError:
+            return False
+
+        return registry_digest == index_entry['digest']
 
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
-        kuber_image_tag = self.config['models'][deployment_status.full_model_name]['KUBER_IMAGE_TAG']
+        model_config: dict = self.config['models'][deployment_status.full_model_name]
+        kuber_image_tag = model_config['KUBER_IMAGE_TAG']
+        build_dir_path: Path = self.config['paths']['models_dir'] / deployment_status.full_model_name
+        build_files = get_build_files(self.config, deployment_status)
+
+        if build_files is not None or build_dir_path.is_dir():
+            buildargs = get_buildargs(model_config)
+            fingerprint = get_files_fingerprint(build_files, buildargs) if build_files is not None \
+                else get_build_fingerprint(build_dir_path, buildargs)
+            deployment_status.build_fingerprint = fingerprint
+            deployment_status.image_cached = self._is_image_cached(kuber_image_tag, fingerprint)
+
+        if deployment_status.image_cached:
+            deployment_status.extended_stage_info = f'image {kuber_image_tag} with build fingerprint ' \
+                                                    f'{deployment_status.build_fingerprint} is in registry, ' \
+                                                    f'skipping delete, build and push'
+            return deployment_status
 
         try:
-            self.docker_client.images.remove(kuber_image_tag)
+            # parent layers are kept to be used as build cache
+            self.docker_client.images.remove(kuber_image_tag, noprune=self.config['docker_layer_cache'])
         except ImageNotFound:
             deployment_status.extended_stage_info = f'image not exists {kuber_image_tag}'
 
@@ -188,44 +424,123 @@ class BuildImageDeploymentStage(AbstractDeploymentStage):
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'build docker image'
         super(BuildImageDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
-        self.docker_client: DockerClient = DockerClient(base_url=config['docker_base_url'])
+
+    def _get_cache_from(self, full_model_name: str, image_tag: str) -> list:
+        """Pulls previous image version from cluster registry to use its layers as build cache."""
+        if not self.config['docker_layer_cache']:
+            return []
+
+        repository, tag = parse_repository_tag(image_tag)
+
+        try:
+            server_response_generator = self.docker_client.api.pull(repository, tag=tag or 'latest',
+                                                                    stream=True, decode=True)
+            tracker = self._track_layers(full_model_name, server_response_generator)
+            self._log(full_model_name, f'pulled cache source image {image_tag}', tracker.get_summary())
+        except APIError as e:
+            self._log(full_model_name, f'no cache source image in registry: {image_tag}', str(e))
+            return []
+
+        return [image_tag]
 
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
+        full_model_name = deployment_status.full_model_name
         models_dir_path = self.config['paths']['models_dir']
-        build_dir_path = str(models_dir_path / deployment_status.full_model_name)
+        build_dir_path = models_dir_path / full_model_name
 
-        model_config: dict = self.config['models'][deployment_status.full_model_name]
+        model_config: dict = self.config['models'][full_model_name]
         image_tag = model_config['KUBER_IMAGE_TAG']
 
-        # TODO: think how to get rid of hardcode buildargs
-        buildarg_keys = ['BASE_IMAGE', 'COMMIT', 'CONFIG', 'RUN_CMD', 'FULL_MODEL_NAME']
-        buildargs = {key: model_config.get(key, '') for key in buildarg_keys}
-        dumped_args = json.dumps(model_config['MODEL_ARGS'])
-        # TODO: find out how to get rid of the replacement
-        dumped_args = dumped_args.replace('"', '\\"').replace('[', '\\[').replace(']', '\\]')
-        buildargs['MODEL_ARGS'] = dumped_args
+        if deployment_status.image_cached:
+            deployment_status.extended_stage_info = f'image {image_tag} is up to date in registry, build skipped'
+            return deployment_status
+
+        buildargs = get_buildargs(model_config)
+        build_files = get_build_files(self.config, deployment_status)
+
+        if build_files is not None:
+            fingerprint = deployment_status.build_fingerprint or get_files_fingerprint(build_files, buildargs)
+            build_context_kwargs = {'fileobj': make_build_context(build_files), 'custom_context': True}
+        else:
+            fingerprint = deployment_status.build_fingerprint or get_build_fingerprint(build_dir_path, buildargs)
+            build_context_kwargs = {'path': str(build_dir_path)}
 
         kwargs = {
-            'path': build_dir_path,
+            **build_context_kwargs,
             'tag': image_tag,
             'rm': True,
-            'buildargs': buildargs
+            'buildargs': buildargs,
+            'labels': {BUILD_FINGERPRINT_LABEL: fingerprint},
+            'cache_from': self._get_cache_from(full_model_name, image_tag),
+            'decode': True
         }
 
-        self.docker_client.images.build(**kwargs)
+        build_log = []
+        step = {'name': None, 'output': [], 'start_time': time.monotonic(), 'cache_hit': False}
+        build_start_time = time.monotonic()
+        step_durations = {}
+        cache_hits = cache_misses = 0
+        image_id = None
+
+        def finish_step() -> None:
+            step_durations[step['name']] = time.monotonic() - step['start_time']
+            cache_info = ', cache hit' if step['cache_hit'] else ''
+            self._log(full_model_name,
+                      f'{step["name"]}, elapsed time: {step_durations[step["name"]]:.1f}s{cache_info}',
+                      '\n\t'.join([''] + step['output']))
+
+        # stream build output by steps instead of waiting for the whole build in silence
+        for chunk in self.docker_client.api.build(**kwargs):
+            build_log.append(chunk)
+
+            if 'error' in chunk:
+                if step['name']:
+                    finish_step()
+                raise BuildError(chunk['error'], build_log)
+
+            if 'aux' in chunk:
+                image_id = chunk['aux'].get('ID', image_id)
+
+            for line in chunk.get('stream', '').splitlines():
+                line = line.strip()
+
+                if not line:
+                    continue
+                elif re.match(r'Step \d+/\d+ :', line):
+                    if step['name']:
+                        finish_step()
+                    step.update(name=line, output=[], start_time=time.monotonic(), cache_hit=False)
+                elif line == '---> Using cache':
+                    step['cache_hit'] = True
+                    cache_hits += 1
+                elif line.startswith('---> Running in'):
+                    cache_misses += 1
+                else:
+                    step['output'].append(line)
+
+        if step['name']:
+            finish_step()
 
-        deployment_status.log_level = LogLevel.INFO
-        deployment_status.log_message = f'Finished [{self.stage_name}] deployment stage ' \
-                                        f'for [{deployment_status.full_model_name}]'
+        slowest_steps = sorted(step_durations.items(), key=lambda item: item[1], reverse=True)[:3]
+        slowest_steps = ', '.join([f'[{step}]: {duration:.1f}s' for step, duration in slowest_steps])
+
+        deployment_status.extended_stage_info = f'image id: {image_id}, ' \
+                                                f'elapsed time: {time.monotonic() - build_start_time:.1f}s, ' \
+                                                f'steps: {len(step_durations)}, cache hits: {cache_hits}, ' \
+                                                f'cache misses: {cache_misses}, slowest steps: {slowest_steps}'
+
+        # build context is not needed by next stages and is not passed through stage queues
+        deployment_status.build_files = None
 
         return deployment_status
 
 
 class TestImageDeploymentStage(AbstractDeploymentStage):
+    uses_poller = True
+
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'test docker image'
         super(TestImageDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
-        self.docker_client: DockerClient = DockerClient(base_url=config['docker_base_url'])
 
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
         # run docker container from built image
@@ -254,14 +569,11 @@ class TestImageDeploymentStage(AbstractDeploymentStage):
         url = self.config['models'][deployment_status.full_model_name]['test_image_url']
         polling_timeout = self.config['models'][deployment_status.full_model_name]['image_polling_timeout_sec']
 
-        polling_result, polling_time = poll(probe=lambda: requests.post(url=url, json={}),
-                                            estimator=lambda result: result.status_code == 200,
-                                            interval_sec=1,
-                                            timeout_sec=polling_timeout)
-
-        polling_result = polling_result.json()
+        polling_result, polling_stats = self._probe_model_api(url, {}, polling_timeout)
         self.container.stop()
-        deployment_status.extended_stage_info = f'elapsed time: {polling_time}, model response: {polling_result}'
+        deployment_status.extended_stage_info = f'elapsed time: {polling_stats.polling_time}, ' \
+                                                f'probe attempts: {polling_stats.attempts}, ' \
+                                                f'model response: {polling_result}'
 
         return deployment_status
 
@@ -270,13 +582,22 @@ class PushImageDeploymentStage(AbstractDeploymentStage):
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'push to cluster repo'
         super(PushImageDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
-        self.docker_client: DockerClient = DockerClient(base_url=config['docker_base_url'])
+        self.build_index = ImageBuildIndex(config['paths']['build_index_dir'])
 
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
         image_tag = self.config['models'][deployment_status.full_model_name]['KUBER_IMAGE_TAG']
-        server_response_generator = self.docker_client.images.push(image_tag, stream=True)
-        server_response = '\t{}'.format('\n\t'.join([str(resp_str) for resp_str in server_response_generator]))
-        deployment_status.extended_stage_info = f'server response:\n{server_response}'
+
+        if deployment_status.image_cached:
+            deployment_status.extended_stage_info = f'image {image_tag} is up to date in registry, push skipped'
+            return deployment_status
+
+        server_response_generator = self.docker_client.api.push(image_tag, stream=True, decode=True)
+        tracker = self._track_layers(deployment_status.full_model_name, server_response_generator)
+        deployment_status.extended_stage_info = tracker.get_summary()
+
+        fingerprint = self.docker_client.images.get(image_tag).labels.get(BUILD_FINGERPRINT_LABEL)
+        if fingerprint and tracker.digest:
+            self.build_index.put(image_tag, fingerprint, tracker.digest)
 
         return deployment_status
 
@@ -285,13 +606,14 @@ class PullImageDeploymentStage(AbstractDeploymentStage):
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'pull from cluster repo'
         super(PullImageDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
-        self.docker_client: DockerClient = DockerClient(base_url=config['docker_base_url'])
 
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
         image_tag = self.config['models'][deployment_status.full_model_name]['KUBER_IMAGE_TAG']
-        server_response_generator = self.docker_client.images.pull(image_tag)
-        server_response = '\t{}'.format('\n\t'.join([str(resp_str) for resp_str in server_response_generator]))
-        deployment_status.extended_stage_info = f'server response:\n{server_response}'
+        repository, tag = parse_repository_tag(image_tag)
+        server_response_generator = self.docker_client.api.pull(repository, tag=tag or 'latest',
+                                                                stream=True, decode=True)
+        tracker = self._track_layers(deployment_status.full_model_name, server_response_generator)
+        deployment_status.extended_stage_info = tracker.get_summary()
 
         return deployment_status
 
@@ -300,13 +622,26 @@ class AbstractKuberEntitiesHandler(AbstractDeploymentStage):
     def __init__(self, config: dict, stage_name: str, in_queue: Queue, out_queue: Queue):
         super(AbstractKuberEntitiesHandler, self).__init__(config, stage_name, in_queue, out_queue)
 
-        kube_config.load_kube_config()
-        self.kube_apps_v1_beta1_api = kube_client.AppsV1beta1Api()
-        self.kube_core_v1_api = kube_client.CoreV1Api()
-
         self.dp_data: Optional[KuberEntityData] = None
         self.lb_data: Optional[KuberEntityData] = None
 
+    # clients and objects cache are created on the first use and shared by all Kubernetes stages of the process
+    @property
+    def kube_apps_v1_beta1_api(self) -> kube_client.AppsV1beta1Api:
+        return get_kuber_clients().apps_v1_beta1_api
+
+    @property
+    def kube_apps_v1_api(self) -> kube_client.AppsV1Api:
+        return get_kuber_clients().apps_v1_api
+
+    @property
+    def kube_core_v1_api(self) -> kube_client.CoreV1Api:
+        return get_kuber_clients().core_v1_api
+
+    @property
+    def kuber_cache(self) -> KuberObjectsCache:
+        return get_kuber_cache()
+
     def update_kuber_configs(self, deployment_status: DeploymentStatus) -> None:
         kuber_configs_dir: Path = self.config['paths']['kuber_configs_dir'] / deployment_status.full_model_name
 
@@ -351,6 +686,96 @@ class AbstractKuberEntitiesHandler(AbstractDeploymentStage):
         pass
 
 
+class PrePullImageDeploymentStage(AbstractKuberEntitiesHandler):
+    uses_poller = True
+
+    def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
+        stage_name = 'pre-pull image on cluster nodes'
+        super(PrePullImageDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
+
+    def _make_daemon_set_config(self, name: str) -> dict:
+        """Makes DaemonSet which pulls Deployment images with init containers on each node eligible for its pods."""
+        pod_spec: dict = self.dp_data.config['spec']['template']['spec']
+        images = [container['image'] for container in pod_spec['containers']]
+
+        init_containers = [{'name': f'prepull-{i}',
+                            'image': image,
+                            'imagePullPolicy': 'Always',
+                            'command': ['/bin/sh', '-c', 'true']} for i, image in enumerate(images)]
+
+        daemon_set_pod_spec = {
+            'initContainers': init_containers,
+            'containers': [{'name': 'pause', 'image': self.config['prepull_pause_image']}],
+            'terminationGracePeriodSeconds': 0
+        }
+
+        # images are pulled from the same registries and only on nodes where Deployment pods can be scheduled
+        for key in ['imagePullSecrets', 'nodeSelector', 'affinity', 'tolerations']:
+            if key in pod_spec:
+                daemon_set_pod_spec[key] = pod_spec[key]
+
+        return {
+            'apiVersion': 'apps/v1',
+            'kind': 'DaemonSet',
+            'metadata': {'name': name, 'namespace': self.dp_data.namespace, 'labels': {'app': name}},
+            'spec': {
+                'selector': {'matchLabels': {'app': name}},
+                'template': {
+                    'metadata': {'labels': {'app': name}},
+                    'spec': daemon_set_pod_spec
+                }
+            }
+        }
+
+    def _delete_daemon_set(self, name: str) -> None:
+        try:
+            self.kube_apps_v1_api.delete_namespaced_daemon_set(
+                name=name,
+                namespace=self.dp_data.namespace,
+                body=kube_client.V1DeleteOptions(propagation_policy='Background'))
+        except ApiException as e:
+            if e.status != 404:
+                raise
+
+    def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
+        self.update_kuber_configs(deployment_status)
+
+        if not self.dp_data:
+            deployment_status.extended_stage_info = 'no Deployment config, nothing to pre-pull'
+            return deployment_status
+
+        model_config: dict = self.config['models'][deployment_status.full_model_name]
+        name = f'{self.dp_data.name}-prepull'
+        namespace = self.dp_data.namespace
+
+        # DaemonSet can be left by interrupted previous run
+        self._delete_daemon_set(name)
+        self.kube_apps_v1_api.create_namespaced_daemon_set(namespace=namespace,
+                                                           body=self._make_daemon_set_config(name))
+
+        def estimate(daemon_set: kube_client.V1DaemonSet) -> bool:
+            status: kube_client.V1DaemonSetStatus = daemon_set.status
+            return status.desired_number_scheduled is not None and \
+                status.desired_number_scheduled > 0 and \
+                status.number_ready == status.desired_number_scheduled
+
+        try:
+            polling_task = self.poller.submit(
+                probe=lambda: self.kube_apps_v1_api.read_namespaced_daemon_set_status(name=name, namespace=namespace),
+                estimator=estimate,
+                interval_sec=2,
+                timeout_sec=model_config['prepull_timeout_sec'])
+
+            polling_result, polling_stats = polling_task.wait()
+        finally:
+            self._delete_daemon_set(name)
+
+        deployment_status.extended_stage_info = f'images pulled on {polling_result.status.number_ready} nodes, ' \
+                                                f'elapsed time: {polling_stats.polling_time}'
+
+        return deployment_status
+
+
 class DeployKuberDeploymentStage(AbstractKuberEntitiesHandler):
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'deploy in kubernetes'
@@ -384,42 +809,138 @@ class DeployKuberDeploymentStage(AbstractKuberEntitiesHandler):
         return deployment_status
 
 
+class ApplyKuberDeploymentStage(AbstractKuberEntitiesHandler):
+    """Updates Kubernetes Deployment and Load Balancer in place, so model keeps serving during redeployment."""
+    rolling_update_strategy = {'type': 'RollingUpdate', 'rollingUpdate': {'maxUnavailable': 0, 'maxSurge': 1}}
+
+    def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
+        stage_name = 'apply kubernetes deployment'
+        super(ApplyKuberDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
+
+    @staticmethod
+    def _is_subset(desired, actual) -> bool:
+        """Checks that all values set in desired config are the same in actual object, ignoring server defaults."""
+        if isinstance(desired, dict):
+            return isinstance(actual, dict) and \
+                all(ApplyKuberDeploymentStage._is_subset(value, actual.get(key)) for key, value in desired.items())
+        elif isinstance(desired, list):
+            return isinstance(actual, list) and len(desired) == len(actual) and \
+                all(ApplyKuberDeploymentStage._is_subset(d, a) for d, a in zip(desired, actual))
+        else:
+            return str(desired) == str(actual)
+
+    def _apply_deployment(self, deployment_status: DeploymentStatus) -> None:
+        name = self.dp_data.name
+        namespace = self.dp_data.namespace
+        body: dict = deepcopy(self.dp_data.config)
+        body['spec'].setdefault('strategy', self.rolling_update_strategy)
+
+        # new annotation value forces new ReplicaSet rollout even if image tag and pod spec remain the same
+        template_metadata: dict = body['spec']['template'].setdefault('metadata', {})
+        template_annotations: dict = template_metadata.setdefault('annotations', {})
+        template_annotations['deployer/applied-at'] = datetime.utcnow().isoformat()
+
+        if self.kuber_cache.get('deployment', namespace, name):
+            deployment = self.kube_apps_v1_beta1_api.replace_namespaced_deployment(name=name,
+                                                                                  namespace=namespace,
+                                                                                  body=body)
+            deployment_status.extended_stage_info += f'; rolling update of Deployment: {name}'
+        else:
+            deployment = self.kube_apps_v1_beta1_api.create_namespaced_deployment(namespace=namespace, body=body)
+            deployment_status.extended_stage_info += f'; created Deployment: {name}'
+
+        generation = deployment.metadata.generation
+
+        def is_rolled_out() -> bool:
+            dp: kube_client.AppsV1beta1Deployment = self.kuber_cache.get('deployment', namespace, name)
+            if dp is None:
+                return False
+
+            replicas = dp.spec.replicas
+            status: kube_client.AppsV1beta1DeploymentStatus = dp.status
+            return status.observed_generation is not None and status.observed_generation >= generation and \
+                status.updated_replicas == replicas and status.replicas == replicas and \
+                status.available_replicas == replicas
+
+        polling_timeout = self.config['models'][deployment_status.full_model_name]['deployment_polling_timeout_sec']
+        start_time = time.monotonic()
+
+        if not self.kuber_cache.wait_for(is_rolled_out, polling_timeout, [('deployment', namespace)]):
+            raise TimeoutError(f'Deployment {name} was not rolled out in {polling_timeout} seconds')
+
+        deployment_status.extended_stage_info += f'; new ReplicaSet available, ' \
+                                                 f'elapsed time: {time.monotonic() - start_time:.1f}s'
+
+    def _apply_load_balancer(self, deployment_status: DeploymentStatus) -> None:
+        name = self.lb_data.name
+        namespace = self.lb_data.namespace
+        service = self.kuber_cache.get('service', namespace, name)
+
+        if service is None:
+            self.kube_core_v1_api.create_namespaced_service(namespace=namespace, body=self.lb_data.config)
+            deployment_status.extended_stage_info += f'; created Load Balancer: {name}'
+            return
+
+        service_spec = self.kube_core_v1_api.api_client.sanitize_for_serialization(service.spec)
+
+        if self._is_subset(self.lb_data.config['spec'], service_spec):
+            deployment_status.extended_stage_info += f'; Load Balancer unchanged: {name}'
+        else:
+            self.kube_core_v1_api.patch_namespaced_service(name=name, namespace=namespace, body=self.lb_data.config)
+            deployment_status.extended_stage_info += f'; patched Load Balancer: {name}'
+
+    def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
+        self.update_kuber_configs(deployment_status)
+
+        # Load Balancer is applied first, so it already routes to the new pods when they become available
+        if self.lb_data:
+            self._apply_load_balancer(deployment_status)
+
+        if self.dp_data:
+            self._apply_deployment(deployment_status)
+
+        deployment_status.extended_stage_info = deployment_status.extended_stage_info.strip('; ')
+
+        return deployment_status
+
+
 class DeleteKuberDeploymentStage(AbstractKuberEntitiesHandler):
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'delete kubernetes deployment'
         super(DeleteKuberDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
 
+    def _delete(self, kind: str, delete_method, entity_data: KuberEntityData, timeout_sec: float) -> bool:
+        """Deletes object if cache has it and waits until the deletion is seen by watch, returns False if absent."""
+        if self.kuber_cache.get(kind, entity_data.namespace, entity_data.name) is None:
+            return False
+
+        try:
+            delete_method(name=entity_data.name,
+                          namespace=entity_data.namespace,
+                          body=kube_client.V1DeleteOptions(propagation_policy='Background'))
+        except ApiException as e:
+            if e.status != 404:
+                raise
+
+        self.kuber_cache.wait_for_deleted(kind, entity_data.namespace, entity_data.name, timeout_sec)
+
+        return True
+
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
         self.update_kuber_configs(deployment_status)
+        timeout = self.config['models'][deployment_status.full_model_name]['deployment_polling_timeout_sec']
 
         # remove Kubernetes Deployment
         if self.dp_data:
-            deployments_raw = self.kube_apps_v1_beta1_api.list_namespaced_deployment(namespace=self.dp_data.namespace)
-            deployments = [item.metadata.name for item in deployments_raw.items]
-
-            if self.dp_data.name in deployments:
-                delete_dp_kwargs = {
-                    'name': self.dp_data.name,
-                    'namespace': self.dp_data.namespace,
-                    'body': kube_client.V1DeleteOptions(propagation_policy='Background')
-                }
-                self.kube_apps_v1_beta1_api.delete_namespaced_deployment(**delete_dp_kwargs)
+            if self._delete('deployment', self.kube_apps_v1_beta1_api.delete_namespaced_deployment,
+                            self.dp_data, timeout):
                 deployment_status.extended_stage_info += f'; deleted Deployment: {self.dp_data.name}'
             else:
                 deployment_status.extended_stage_info += f'; Deployment not exists: {self.dp_data.name}'
 
         # remove Kubernetes Load Balancer
         if self.lb_data:
-            load_balancers_raw = self.kube_core_v1_api.list_namespaced_service(namespace=self.lb_data.namespace)
-            load_balancers = [item.metadata.name for item in load_balancers_raw.items]
-
-            if self.lb_data.name in load_balancers:
-                delete_lb_kwargs = {
-                    'name': self.lb_data.name,
-                    'namespace': self.lb_data.namespace,
-                    'body': kube_client.V1DeleteOptions(propagation_policy='Background')
-                }
-                self.kube_core_v1_api.delete_namespaced_service(**delete_lb_kwargs)
+            if self._delete('service', self.kube_core_v1_api.delete_namespaced_service, self.lb_data, timeout):
                 deployment_status.extended_stage_info += f'; deleted Load Balancer: {self.lb_data.name}'
             else:
                 deployment_status.extended_stage_info += f'; Load Balancer not exists: {self.lb_data.name}'
@@ -429,28 +950,138 @@ class DeleteKuberDeploymentStage(AbstractKuberEntitiesHandler):
         return deployment_status
 
 
-class TestKuberDeploymentStage(AbstractDeploymentStage):
+class TestKuberDeploymentStage(AbstractKuberEntitiesHandler):
+    uses_poller = True
+
+    # container waiting reasons which will not be resolved without redeployment
+    failure_reasons = {'ErrImagePull', 'ImagePullBackOff', 'InvalidImageName', 'CrashLoopBackOff',
+                       'CreateContainerConfigError', 'CreateContainerError'}
+
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'test kuber deployment'
         super(TestKuberDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
 
+    def _get_current_pods(self) -> list:
+        """Returns not terminating pods of the current Deployment ReplicaSet.
+
+        Pods are matched by owner references, so pods of deleted Deployment with the same name and labels, which
+        can be still running after Deployment was recreated, are not taken as current.
+        """
+        namespace = self.dp_data.namespace
+        deployment = self.kuber_cache.get('deployment', namespace, self.dp_data.name)
+
+        if deployment is None:
+            return []
+
+        # revision is set by Deployment controller, so it is absent until controller handles new Deployment
+        revision = (deployment.metadata.annotations or {}).get(REVISION_ANNOTATION)
+
+        if revision is None:
+            return []
+
+        replica_set_uids = {replica_set.metadata.uid for replica_set in self.kuber_cache.list('replicaset', namespace)
+                            if (replica_set.metadata.annotations or {}).get(REVISION_ANNOTATION) == revision and
+                            any(owner.uid == deployment.metadata.uid
+                                for owner in replica_set.metadata.owner_references or [])}
+
+        pod_labels = self.dp_data.config['spec']['template']['metadata']['labels']
+
+        return [pod for pod in self.kuber_cache.list('pod', namespace, pod_labels)
+                if pod.metadata.deletion_timestamp is None and
+                any(owner.uid in replica_set_uids for owner in pod.metadata.owner_references or [])]
+
+    def _get_failure(self, pods: list) -> Optional[str]:
+        for pod in pods:
+            for container_status in pod.status.container_statuses or []:
+                waiting = container_status.state.waiting if container_status.state else None
+                if waiting and waiting.reason in self.failure_reasons:
+                    return f'pod {pod.metadata.name}, container {container_status.name}: ' \
+                           f'{waiting.reason}: {waiting.message}'
+
+        return None
+
+    @staticmethod
+    def _is_ready(pod: kube_client.V1Pod) -> bool:
+        return any(condition.type == 'Ready' and condition.status == 'True'
+                   for condition in pod.status.conditions or [])
+
+    def _get_phase_timings(self, pod: kube_client.V1Pod) -> str:
+        """Returns pod lifecycle phases times relative to pod creation."""
+        created = pod.metadata.creation_timestamp
+        phases = {}
+
+        for condition in pod.status.conditions or []:
+            if condition.type == 'PodScheduled' and condition.status == 'True':
+                phases['scheduled'] = condition.last_transition_time
+            elif condition.type == 'Ready' and condition.status == 'True':
+                phases['ready'] = condition.last_transition_time
+
+        try:
+            pulled_events = self.kube_core_v1_api.list_namespaced_event(
+                namespace=pod.metadata.namespace,
+                field_selector=f'involvedObject.name={pod.metadata.name},reason=Pulled')
+            pulled_times = [event.last_timestamp for event in pulled_events.items if event.last_timestamp]
+            if pulled_times:
+                phases['pulled'] = max(pulled_times)
+        except ApiException:
+            pass
+
+        started_times = [container_status.state.running.started_at
+                         for container_status in pod.status.container_statuses or []
+                         if container_status.state and container_status.state.running]
+        if started_times:
+            phases['container started'] = max(started_times)
+
+        phases_order = ['scheduled', 'pulled', 'container started', 'ready']
+        timings = [f'{phase}: {(phases[phase] - created).total_seconds():.0f}s'
+                   for phase in phases_order if phases.get(phase)]
+
+        return f'pod {pod.metadata.name} [{", ".join(timings)}]'
+
+    def _wait_pods_ready(self, deployment_status: DeploymentStatus, timeout_sec: float) -> str:
+        replicas = self.dp_data.config['spec'].get('replicas', 1)
+        result = {}
+
+        def is_finished() -> bool:
+            pods = self._get_current_pods()
+            result['failure'] = self._get_failure(pods)
+            result['ready_pods'] = [pod for pod in pods if self._is_ready(pod)]
+            return bool(result['failure']) or len(result['ready_pods']) >= replicas
+
+        namespace = self.dp_data.namespace
+        watched = [('deployment', namespace), ('replicaset', namespace), ('pod', namespace)]
+
+        if not self.kuber_cache.wait_for(is_finished, timeout_sec, watched):
+            raise TimeoutError(f'Deployment {self.dp_data.name} pods are not ready in {timeout_sec} seconds')
+
+        if result['failure']:
+            raise RuntimeError(f'Deployment {self.dp_data.name} failed: {result["failure"]}')
+
+        phase_timings = '; '.join([self._get_phase_timings(pod) for pod in result['ready_pods']])
+        self._log(deployment_status.full_model_name, 'pods are ready', phase_timings)
+
+        return phase_timings
+
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
+        self.update_kuber_configs(deployment_status)
+
         url = self.config['models'][deployment_status.full_model_name]['test_deployment_url']
         model_args = self.config['models'][deployment_status.full_model_name]['MODEL_ARGS']
         json_payload = {arg_name: ['This is probe text.'] for arg_name in model_args}
         polling_timeout = self.config['models'][deployment_status.full_model_name]['deployment_polling_timeout_sec']
+        start_time = time.monotonic()
 
-        polling_result, polling_time = poll(probe=lambda: requests.post(url=url, json=json_payload),
-                                            estimator=lambda result: result.status_code == 200,
-                                            interval_sec=1,
-                                            timeout_sec=polling_timeout)
+        # probe model API only when pods are ready, pod failures are detected from watch events
+        phase_timings = self._wait_pods_ready(deployment_status, polling_timeout) if self.dp_data else ''
+        remaining_timeout = max(polling_timeout - (time.monotonic() - start_time), 1)
 
-        polling_result = polling_result.json()
+        polling_result, polling_stats = self._probe_model_api(url, json_payload, remaining_timeout, first_delay_sec=0)
 
-        deployment_status.log_level = LogLevel.INFO
-        deployment_status.log_message = f'Finished [{self.stage_name}] deployment stage ' \
-                                        f'for [{deployment_status.full_model_name}], ' \
-                                        f'model response: {polling_result}, elapsed time: {polling_time}'
+        deployment_status.extended_stage_info = f'model response: {polling_result}, ' \
+                                                f'elapsed time: {time.monotonic() - start_time:.1f}s, ' \
+                                                f'probe time after pods are ready: {polling_stats.polling_time}, ' \
+                                                f'probe attempts: {polling_stats.attempts}, ' \
+                                                f'{phase_timings}'
 
         return deployment_status
 
@@ -459,10 +1090,13 @@ class PushToDockerHubDeploymentStage(AbstractDeploymentStage):
     def __init__(self, config: dict, in_queue: Queue, out_queue: Queue):
         stage_name = 'push to docker hub'
         super(PushToDockerHubDeploymentStage, self).__init__(config, stage_name, in_queue, out_queue)
-        self.docker_client: DockerClient = DockerClient(base_url=config['docker_base_url'])
-        self.docker_client.login(self.config['dockerhub_registry'], self.config['dockerhub_password'])
+        self.logged_in: bool = False
 
     def _act(self, deployment_status: DeploymentStatus) -> DeploymentStatus:
+        if not self.logged_in:
+            self.docker_client.login(self.config['dockerhub_registry'], self.config['dockerhub_password'])
+            self.logged_in = True
+
         kuber_image_tag = self.config['models'][deployment_status.full_model_name]['KUBER_IMAGE_TAG']
         model_name = self.config['models'][deployment_status.full_model_name]['MODEL_NAME']
         dockerhub_image_tag = f"{self.config['dockerhub_registry']}/{model_name}"
@@ -471,9 +1105,9 @@ class PushToDockerHubDeploymentStage(AbstractDeploymentStage):
         image = images.get(kuber_image_tag)
         image.tag(dockerhub_image_tag)
 
-        server_response_generator = self.docker_client.images.push(dockerhub_image_tag, stream=True)
-        server_response = '\t{}'.format('\n\t'.join([str(resp_str) for resp_str in server_response_generator]))
-        deployment_status.extended_stage_info = f'server response:\n{server_response}'
+        server_response_generator = self.docker_client.api.push(dockerhub_image_tag, stream=True, decode=True)
+        tracker = self._track_layers(deployment_status.full_model_name, server_response_generator)
+        deployment_status.extended_stage_info = tracker.get_summary()
 
         images.remove(dockerhub_image_tag)
 
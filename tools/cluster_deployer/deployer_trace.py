@@ -0,0 +1,161 @@
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+# trace timestamps are in microseconds
+US = 10 ** 6
+# stage end and dependent model enqueue times are taken in different processes
+CLOCK_TOLERANCE_SEC = 0.01
+
+
+def make_trace(stage_timings: list, dependencies: dict, stage_workers: dict) -> dict:
+    """Makes Chrome trace-event timeline (chrome://tracing, Perfetto) of deployment task.
+
+    Each model is a timeline row with stage queue wait and stage action slices. Trace is built from deployer
+    stage_timings: (full model name, stage class name, enqueue time, start time, end time, is failed).
+    """
+    timings = [timing for timing in stage_timings if timing[3] is not None]
+    task_start = min([timing[2] for timing in timings], default=0.0)
+    task_end = max([timing[4] for timing in timings], default=0.0)
+
+    full_model_names = sorted({timing[0] for timing in timings})
+    model_tids = {full_model_name: tid for tid, full_model_name in enumerate(full_model_names, start=1)}
+
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0, 'args': {'name': 'deployment task'}}]
+    events.extend([{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': full_model_name}}
+                   for full_model_name, tid in model_tids.items()])
+
+    for full_model_name, stage_name, enqueue_time, start_time, end_time, is_failed in timings:
+        tid = model_tids[full_model_name]
+
+        events.append({'name': f'queue: {stage_name}', 'cat': 'queue', 'ph': 'X', 'pid': 1, 'tid': tid,
+                       'ts': round((enqueue_time - task_start) * US), 'dur': round((start_time - enqueue_time) * US),
+                       'args': {'model': full_model_name, 'stage': stage_name}})
+
+        events.append({'name': stage_name, 'cat': 'stage', 'ph': 'X', 'pid': 1, 'tid': tid,
+                       'ts': round((start_time - task_start) * US), 'dur': round((end_time - start_time) * US),
+                       'args': {'model': full_model_name, 'stage': stage_name, 'failed': is_failed,
+                                'queue_wait_sec': start_time - enqueue_time}})
+
+    other_data = {'task_start': task_start,
+                  'task_end': task_end,
+                  'stage_workers': stage_workers,
+                  'dependencies': {model: sorted(deps) for model, deps in dependencies.items()}}
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': other_data}
+
+
+def write_trace(trace_path: Path, trace: dict) -> None:
+    trace_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with trace_path.open('w') as f:
+        json.dump(trace, f)
+
+
+def get_latest_trace_path(log_dir: Path) -> Optional[Path]:
+    # trace file names start with UTC timestamp
+    trace_paths = sorted(log_dir.glob('*_trace.json'))
+
+    return trace_paths[-1] if trace_paths else None
+
+
+def load_stages(trace: dict) -> dict:
+    """Returns {full model name: [(stage name, enqueue time, start time, end time, is failed)]} from trace."""
+    model_stages = defaultdict(list)
+
+    for event in trace['traceEvents']:
+        if event.get('cat') != 'stage':
+            continue
+
+        args: dict = event['args']
+        start_time = event['ts'] / US
+        end_time = start_time + event['dur'] / US
+        model_stages[args['model']].append((args['stage'], start_time - args['queue_wait_sec'], start_time, end_time,
+                                            args['failed']))
+
+    return {model: sorted(stages, key=lambda x: x[1]) for model, stages in model_stages.items()}
+
+
+def get_critical_path(model_stages: dict, dependencies: dict) -> list:
+    """Returns [(full model name, stages)] chain which ends with the last finished model.
+
+    Model predecessor in chain is its dependency which stage finished last before model deployment started.
+    """
+    if not model_stages:
+        return []
+
+    critical_path = []
+    full_model_name = max(model_stages.keys(), key=lambda model: model_stages[model][-1][3])
+
+    while full_model_name is not None:
+        stages = model_stages[full_model_name]
+        critical_path.append((full_model_name, stages))
+        first_enqueue_time = stages[0][1]
+
+        releases = [(stage[3], dependency) for dependency in dependencies.get(full_model_name, [])
+                    for stage in model_stages.get(dependency, [])
+                    if stage[3] <= first_enqueue_time + CLOCK_TOLERANCE_SEC]
+
+        full_model_name = max(releases)[1] if releases else None
+
+    return list(reversed(critical_path))
+
+
+def get_max_concurrency(intervals: list) -> int:
+    points = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    concurrency = max_concurrency = 0
+
+    for _, delta in points:
+        concurrency += delta
+        max_concurrency = max(max_concurrency, concurrency)
+
+    return max_concurrency
+
+
+def summarize_trace(trace: dict) -> str:
+    """Returns critical path and per-stage utilisation summary of deployment task trace."""
+    other_data: dict = trace['otherData']
+    model_stages = load_stages(trace)
+    wall_time = other_data['task_end'] - other_data['task_start']
+
+    stages_num = sum([len(stages) for stages in model_stages.values()])
+    failed = sorted([model for model, stages in model_stages.items() if any(stage[4] for stage in stages)])
+
+    lines = [f'Task: wall time {wall_time:.1f}s, models: {len(model_stages)}, stages processed: {stages_num}, '
+             f'failed models: {len(failed)}']
+
+    critical_path = get_critical_path(model_stages, other_data['dependencies'])
+
+    if critical_path:
+        path_start = critical_path[0][1][0][1]
+        path_end = critical_path[-1][1][-1][3]
+        path_wait = sum([stage[2] - stage[1] for _, stages in critical_path for stage in stages])
+        lines.append(f'Critical path: {path_end - path_start:.1f}s, of them waiting in stage queues: {path_wait:.1f}s')
+
+        for full_model_name, stages in critical_path:
+            stages_str = ', '.join([f'{stage[0]} (wait {stage[2] - stage[1]:.1f}s, run {stage[3] - stage[2]:.1f}s)'
+                                    for stage in stages])
+            lines.append(f'\t[{full_model_name}]: {stages_str}')
+
+    stage_intervals = defaultdict(list)
+    stage_waits = defaultdict(list)
+
+    for stages in model_stages.values():
+        for stage_name, enqueue_time, start_time, end_time, _ in stages:
+            stage_intervals[stage_name].append((start_time, end_time))
+            stage_waits[stage_name].append(start_time - enqueue_time)
+
+    lines.append('Stage utilisation (busy time / (workers * wall time)):')
+
+    for stage_name, intervals in sorted(stage_intervals.items(), key=lambda x: min(x[1])):
+        workers = other_data['stage_workers'].get(stage_name, 1)
+        busy_time = sum([end - start for start, end in intervals])
+        utilisation = busy_time / (workers * wall_time) if wall_time > 0 else 0.0
+        waits = stage_waits[stage_name]
+
+        lines.append(f'\t{stage_name}: workers {workers}, max concurrent {get_max_concurrency(intervals)}, '
+                     f'busy {busy_time:.1f}s, utilisation {utilisation:.0%}, '
+                     f'queue wait avg {sum(waits) / len(waits):.1f}s, max {max(waits):.1f}s')
+
+    return '\n'.join(lines)
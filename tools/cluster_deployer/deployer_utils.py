@@ -1,13 +1,16 @@
+import hashlib
 import json
 import yaml
 import shutil
 import re
-from copy import deepcopy
 from pathlib import Path
-from datetime import datetime, timedelta
-from threading import Timer
-from queue import Queue
-from typing import Callable, Any, Tuple, Optional
+from collections.abc import Mapping
+from typing import Any, Optional, Iterator
+
+from deployer_config_cache import ConfigCache
+
+# libyaml based loader is much faster, pure Python loader is used if PyYAML is built without libyaml
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 
 def safe_delete_path(path: Path):
@@ -31,80 +34,113 @@ def fill_placeholders_from_dict(str_in: str, values_dict: dict) -> str:
     return str_out
 
 
-def fill_dict_placeholders_recursive(dict_in: dict) -> dict:
-    pattern = r'{{([A-Za-z_]+)}}'
-    dict_out = {}
-    completed = True
+def render_template_files(template_dir: Path, model_config: dict) -> dict:
+    """Returns model deployment files {relative path: contents} rendered from model template files.
 
-    for key, value in dict_in.items():
-        if isinstance(value, str):
-            dict_out[key] = fill_placeholders_from_dict(value, dict_in)
-            completed &= not bool(re.search(pattern, dict_out[key]))
-        else:
-            dict_out[key] = value
+    Template placeholders are filled with model config values and template files are given deployment names.
+    """
+    deployment_file_names = {
+        'run_model.sh': model_config['RUN_FILE'],
+        'dockerignore': '.dockerignore',
+        'kuber_dp.yaml': model_config['KUBER_DP_FILE'],
+        'kuber_lb.yaml': model_config['KUBER_LB_FILE']
+    }
+
+    files = {}
+
+    for template_file in sorted(path for path in template_dir.rglob('*') if path.is_file()):
+        file_name = template_file.relative_to(template_dir).as_posix()
+        file_name = deployment_file_names.get(file_name, file_name)
+        files[file_name] = fill_placeholders_from_dict(template_file.read_text(), model_config).encode('utf-8')
+
+    if model_config['serialize_config']:
+        files['deployment_config.json'] = json.dumps(model_config, indent=2).encode('utf-8')
+
+    return files
 
-    dict_out = dict_out if completed else fill_dict_placeholders_recursive(dict_out)
+
+def fill_dict_placeholders(dict_in: dict) -> dict:
+    """Fills {{key}} placeholders of dict string values with dict values in one pass.
+
+    Placeholders are resolved in topological order of their references, so each value is filled only once.
+    Raises KeyError on undefined placeholder and ValueError on placeholders reference cycle.
+    """
+    pattern = re.compile(r'{{([A-Za-z_]+)}}')
+    references = {key: set(pattern.findall(value)) for key, value in dict_in.items() if isinstance(value, str)}
+
+    for key, names in references.items():
+        undefined = names - dict_in.keys()
+        if undefined:
+            raise KeyError(f'Undefined placeholders in {key}: {", ".join(sorted(undefined))}')
+
+    dict_out = dict(dict_in)
+
+    def render(value: Any) -> str:
+        return json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+
+    for key in get_topological_order(references, 'Placeholders cycle'):
+        if references.get(key):
+            dict_out[key] = pattern.sub(lambda x: render(dict_out[x.group(1)]), dict_out[key])
 
     return dict_out
 
 
-def make_config_from_files(config_dir_path: Path, root_dir: Path, models_config_path: Optional[Path] = None) -> dict:
-    config_file_path = config_dir_path / 'config.yaml'
-    model_groups_path = config_dir_path / 'model_groups.yaml'
-    templates_path = config_dir_path / 'templates.yaml'
-    model_configs_path = config_dir_path / 'models'
+def load_yaml(file_path: Path) -> Any:
+    with file_path.open('r') as f:
+        return yaml.load(f, Loader=YamlLoader)
 
-    with config_file_path.open('r') as f:
-        config: dict = yaml.load(f)
 
-    with model_groups_path.open('r') as f:
-        model_groups: dict = yaml.load(f)
+class ModelsConfig(Mapping):
+    """Models configs mapping which renders model config only when it is accessed.
 
-    with templates_path.open('r') as f:
-        templates: dict = yaml.load(f)
+    Raw model entries are indexed by full model name, templates merge and placeholders filling are made on
+    the first access to the model and the result is memoized, so rendered configs can be modified in place.
+    """
+    def __init__(self, raw_models: dict, templates: dict, models_merge_config: dict) -> None:
+        self.raw_models: dict = raw_models
+        self.templates: dict = templates
+        self.models_merge_config: dict = models_merge_config
+        self._rendered: dict = {}
 
-    models = {}
-    for models_config_file in model_configs_path.iterdir():
-        if models_config_file.is_file():
-            with models_config_file.open('r') as f:
-                model_configs = yaml.load(f)
-                models.update(**model_configs)
+    def __getitem__(self, full_model_name: str) -> dict:
+        if full_model_name not in self._rendered:
+            self._rendered[full_model_name] = self._render(full_model_name)
 
-    if models_config_path:
-        with models_config_path.open('r') as f:
-            models_merge_config: dict = yaml.load(f)
-    else:
-        models_merge_config = {}
+        return self._rendered[full_model_name]
 
-    # make paths
-    config['paths']['root_dir'] = str(root_dir)
-    config['paths'] = fill_dict_placeholders_recursive(config['paths'])
-    config['paths'] = {key: Path(value) for key, value in config['paths'].items()}
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.raw_models)
 
-    # add model groups
-    config['model_groups'] = model_groups
+    def __len__(self) -> int:
+        return len(self.raw_models)
 
-    # make model configs
-    config['models'] = {}
+    def __contains__(self, full_model_name: object) -> bool:
+        return full_model_name in self.raw_models
 
-    for model_full_name, model_config_params in models.items():
-        # all capitalised keys are used in deploy files placeholders filling
-        model_config = deepcopy(templates['_root'])  # get config params from root template
+    def get_unrendered(self, full_model_name: str) -> dict:
+        """Returns model config merged with its templates without filled placeholders."""
+        model_config_params: dict = self.raw_models[full_model_name]
 
+        # TODO: uncapitalize template
+        # config params from root template, model template, model config and external model config file,
+        # values are not modified in place, so templates are not copied
+        return {**self.templates['_root'],
+                **self.templates[model_config_params['TEMPLATE']],
+                **model_config_params,
+                **self.models_merge_config.get(full_model_name, {})}
+
+    def _render(self, full_model_name: str) -> dict:
+        # all capitalised keys are used in deploy files placeholders filling
         pattern = r'(.+?)_(.+)'
-        match = re.search(pattern, model_full_name)
+        match = re.search(pattern, full_model_name)
 
         if not match:
-            raise KeyError(f'Wrong model full name: {model_full_name}, should be in <prefix>_<model_name> fromat')
-        else:
-            model_config['FULL_MODEL_NAME'] = model_full_name
-            model_config['PREFIX'] = match.group(1)
-            model_config['MODEL_NAME'] = match.group(2)
+            raise KeyError(f'Wrong model full name: {full_model_name}, should be in <prefix>_<model_name> fromat')
 
-        # TODO: uncapitalize template
-        model_config.update(**templates[model_config_params['TEMPLATE']])  # get config params from model template
-        model_config.update(**model_config_params)  # get config params from model config
-        model_config.update(**models_merge_config.get(model_full_name, {}))  # merge with external model config file
+        model_config = self.get_unrendered(full_model_name)
+        model_config['FULL_MODEL_NAME'] = full_model_name
+        model_config['PREFIX'] = match.group(1)
+        model_config['MODEL_NAME'] = match.group(2)
 
         run_mode: str = model_config['run_mode']
         run_params: dict = model_config.get('run_params', {})
@@ -115,55 +151,108 @@ def make_config_from_files(config_dir_path: Path, root_dir: Path, models_config_
         model_config['FULL_MODEL_NAME_DASHED'] = model_config['FULL_MODEL_NAME'].replace('_', '-')
 
         # fill model config placeholders
-        model_config: dict = fill_dict_placeholders_recursive(model_config)
+        return fill_dict_placeholders(model_config)
 
-        if model_config['FULL_MODEL_NAME'] not in config['models'].keys():
-            config['models'][model_config['FULL_MODEL_NAME']] = model_config
-        else:
-            raise KeyError(f'Double full model name: {model_config["FULL_MODEL_NAME"]}')
+
+def make_config_from_files(config_dir_path: Path, root_dir: Path, models_config_path: Optional[Path] = None,
+                           cache_dir: Optional[Path] = None) -> dict:
+    """Compiles deployer config from config files, compiled config is cached until any input file is changed.
+
+    Models configs are rendered lazily, see ModelsConfig.
+    """
+    config_file_path = config_dir_path / 'config.yaml'
+    model_groups_path = config_dir_path / 'model_groups.yaml'
+    templates_path = config_dir_path / 'templates.yaml'
+    model_configs_path = config_dir_path / 'models'
+
+    models_config_files = sorted(path for path in model_configs_path.iterdir() if path.is_file())
+    input_files = [config_file_path, model_groups_path, templates_path, *models_config_files]
+    input_files += [models_config_path] if models_config_path else []
+
+    config_cache = ConfigCache(cache_dir / 'config.pickle', input_files, {'root_dir': str(root_dir)}) \
+        if cache_dir else None
+
+    if config_cache:
+        config = config_cache.get()
+        if config is not None:
+            return config
+
+    config: dict = load_yaml(config_file_path)
+    model_groups: dict = load_yaml(model_groups_path)
+    templates: dict = load_yaml(templates_path)
+
+    raw_models = {}
+    for models_config_file in models_config_files:
+        raw_models.update(**load_yaml(models_config_file))
+
+    models_merge_config: dict = load_yaml(models_config_path) if models_config_path else {}
+
+    # make paths
+    config['paths']['root_dir'] = str(root_dir)
+    config['paths'] = fill_dict_placeholders(config['paths'])
+    config['paths'] = {key: Path(value) for key, value in config['paths'].items()}
+
+    # add model groups
+    config['model_groups'] = model_groups
+
+    # add model configs
+    config['models'] = ModelsConfig(raw_models, templates, models_merge_config)
+
+    if config_cache:
+        config_cache.put(config)
 
     return config
 
 
-# TODO: needs refactoring
-def poll(probe: Callable, interval_sec: float, timeout_sec: float,
-         estimator: Callable, *args, **kwargs) -> Tuple[Any, timedelta]:
+def get_model_fingerprint(model_config: dict, templates_dir: Path) -> str:
+    """Returns hash of model deployment inputs: model config params and its template files."""
+    fingerprint = hashlib.sha256()
 
-    interval_sec = 0.001 if interval_sec < 0.001 else round(interval_sec, 3)
-    timeout_sec = 0.001 if timeout_sec < 0.001 else round(timeout_sec, 3)
+    # pipeline and dependencies do not affect deployment artifacts
+    inputs_config = {key: value for key, value in model_config.items() if key not in ('pipeline', 'depends_on')}
+    fingerprint.update(json.dumps(inputs_config, sort_keys=True, default=str).encode('utf-8'))
 
-    queue = Queue()
+    template_dir: Path = templates_dir / model_config['TEMPLATE']
+    template_files = sorted(path for path in template_dir.rglob('*') if path.is_file())
 
-    def set_timer(in_timestamp: datetime, in_timeout: timedelta):
-        if datetime.utcnow() >= in_timestamp + in_timeout:
-            q_out = {'result': None, 'timeout': True, 'polling_time': None}
-            queue.put(q_out)
-        else:
-            try:
-                result = probe(*args, **kwargs)
-            except Exception:
-                result = None
-
-            if result and estimator(result):
-                q_out = {'result': result, 'timeout': False, 'polling_time': datetime.utcnow() - in_timestamp}
-                queue.put(q_out)
-            else:
-                in_timer = Timer(interval_sec, set_timer, [timestamp, timeout])
-                in_timer.start()
-
-    timestamp = datetime.utcnow()
-    timeout = timedelta(seconds=timeout_sec)
-
-    timer = Timer(interval_sec, set_timer, [timestamp, timeout])
-    timer.start()
-
-    while True:
-        q_in = queue.get()
-        if q_in['timeout']:
-            _ = probe(*args, **kwargs)
-            raise TimeoutError
-        else:
-            return q_in['result'], q_in['polling_time']
+    for template_file in template_files:
+        fingerprint.update(str(template_file.relative_to(template_dir)).encode('utf-8'))
+        fingerprint.update(template_file.read_bytes())
+
+    return fingerprint.hexdigest()
+
+
+def get_topological_order(dependencies: dict, cycle_error: str = 'Dependency cycle') -> list:
+    """Returns names of dependencies dict {name: names it depends on}, each name follows names it depends on.
+
+    Raises ValueError if dependencies contain a cycle.
+    """
+    order = []
+    visited = set()
+    path = []
+
+    def visit(name: str) -> None:
+        if name in path:
+            cycle = path[path.index(name):] + [name]
+            raise ValueError(f'{cycle_error}: {" -> ".join(cycle)}')
+
+        if name not in visited:
+            path.append(name)
+            for dependency in dependencies.get(name, []):
+                visit(dependency)
+            path.pop()
+            visited.add(name)
+            order.append(name)
+
+    for key in dependencies.keys():
+        visit(key)
+
+    return order
+
+
+def check_dependency_cycles(dependencies: dict) -> None:
+    """Raises ValueError if dependencies dict {name: set of names it depends on} contains a cycle."""
+    get_topological_order(dependencies)
 
 
 def prompt_confirmation(question: str, default: Optional[str] = None) -> bool:
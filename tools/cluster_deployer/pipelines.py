@@ -1,7 +1,7 @@
 from deployer_stages import MakeFilesDeploymentStage, BuildImageDeploymentStage, DeleteKuberDeploymentStage
 from deployer_stages import TestImageDeploymentStage, PushImageDeploymentStage, PullImageDeploymentStage
-from deployer_stages import DeployKuberDeploymentStage, TestKuberDeploymentStage
-from deployer_stages import PushToDockerHubDeploymentStage, DeleteImageDeploymentStage
+from deployer_stages import DeployKuberDeploymentStage, TestKuberDeploymentStage, ApplyKuberDeploymentStage
+from deployer_stages import PushToDockerHubDeploymentStage, DeleteImageDeploymentStage, PrePullImageDeploymentStage
 
 all_stages = [MakeFilesDeploymentStage,
               DeleteImageDeploymentStage,
@@ -9,11 +9,18 @@ all_stages = [MakeFilesDeploymentStage,
               TestImageDeploymentStage,
               PushImageDeploymentStage,
               PullImageDeploymentStage,
+              PrePullImageDeploymentStage,
               DeleteKuberDeploymentStage,
               DeployKuberDeploymentStage,
+              ApplyKuberDeploymentStage,
               TestKuberDeploymentStage,
               PushToDockerHubDeploymentStage]
 
+# stages after which dependent models deployment starts, first stage found in model pipeline is used
+dependency_gate_stages = [TestKuberDeploymentStage,
+                          DeployKuberDeploymentStage,
+                          ApplyKuberDeploymentStage]
+
 preset_pipelines = {
     'all': {
         'description': 'full cycle deployment: from making deploying files up to pushing to Docker Hub',
@@ -38,6 +45,42 @@ preset_pipelines = {
                      DeployKuberDeploymentStage,
                      TestKuberDeploymentStage]
     },
+    'all_prepull': {
+        'description': 'full cycle deployment with pre-pulling images on cluster nodes before deploying in Kubernetes',
+        'pipeline': [MakeFilesDeploymentStage,
+                     DeleteImageDeploymentStage,
+                     BuildImageDeploymentStage,
+                     TestImageDeploymentStage,
+                     PushImageDeploymentStage,
+                     PrePullImageDeploymentStage,
+                     DeleteKuberDeploymentStage,
+                     DeployKuberDeploymentStage,
+                     TestKuberDeploymentStage,
+                     PushToDockerHubDeploymentStage]
+    },
+    'all_up_kuber_prepull': {
+        'description': 'full cycle deployment without pushing to Docker Hub with pre-pulling images on cluster nodes',
+        'pipeline': [MakeFilesDeploymentStage,
+                     DeleteImageDeploymentStage,
+                     BuildImageDeploymentStage,
+                     TestImageDeploymentStage,
+                     PushImageDeploymentStage,
+                     PrePullImageDeploymentStage,
+                     DeleteKuberDeploymentStage,
+                     DeployKuberDeploymentStage,
+                     TestKuberDeploymentStage]
+    },
+    'all_up_kuber_rolling': {
+        'description': 'full cycle deployment without pushing to Docker Hub with rolling update in Kubernetes',
+        'pipeline': [MakeFilesDeploymentStage,
+                     DeleteImageDeploymentStage,
+                     BuildImageDeploymentStage,
+                     TestImageDeploymentStage,
+                     PushImageDeploymentStage,
+                     PrePullImageDeploymentStage,
+                     ApplyKuberDeploymentStage,
+                     TestKuberDeploymentStage]
+    },
     'all_up_kuber_no_tests': {
         'description': 'full cycle deployment without pushing to Docker Hub without tests',
         'pipeline': [MakeFilesDeploymentStage,
@@ -91,12 +134,25 @@ preset_pipelines = {
         'description': 'test docker images',
         'pipeline': [TestImageDeploymentStage]
     },
+    'prepull_kuber': {
+        'description': 'pre-pull images on cluster nodes',
+        'pipeline': [PrePullImageDeploymentStage]
+    },
     'create_kuber': {
         'description': 'deploy in Kubernetes and test',
         'pipeline': [DeleteKuberDeploymentStage,
                      DeployKuberDeploymentStage,
                      TestKuberDeploymentStage]
     },
+    'apply_kuber': {
+        'description': 'rolling update in Kubernetes and test',
+        'pipeline': [ApplyKuberDeploymentStage,
+                     TestKuberDeploymentStage]
+    },
+    'apply_kuber_no_tests': {
+        'description': 'rolling update in Kubernetes without test',
+        'pipeline': [ApplyKuberDeploymentStage]
+    },
     'create_kuber_no_tests': {
         'description': 'deploy in Kubernetes without test',
         'pipeline': [DeleteKuberDeploymentStage,
@@ -1,4 +1,5 @@
 import argparse
+import json
 from pathlib import Path
 
 from docker import DockerClient
@@ -7,9 +8,12 @@ from docker.errors import APIError
 from pipelines import preset_pipelines
 from deployer_utils import make_config_from_files, prompt_confirmation
 from deployer import Deployer
+from deployer_benchmark import run_benchmark
+from deployer_trace import get_latest_trace_path, summarize_trace
 
 parser = argparse.ArgumentParser()
-parser.add_argument('action', help='select action', type=str, choices={'build', 'models', 'groups', 'pipelines'})
+parser.add_argument('action', help='select action', type=str,
+                    choices={'build', 'models', 'groups', 'pipelines', 'benchmark', 'trace'})
 
 parser.add_argument('-c', '--models-config', default=None, help='path to models overriding config', type=str)
 
@@ -18,6 +22,15 @@ parser.add_argument('-g', '--group', default=None, help='model group name', type
 parser.add_argument('-p', '--pipeline', default=None, help='pipeline name', type=str)
 
 parser.add_argument('-d', '--dockerhub-pass', default=None, help='Docker Hub password', type=str)
+parser.add_argument('-r', '--resume', action='store_true',
+                    help='skip stages completed by previous runs with unchanged model config and templates')
+
+parser.add_argument('-n', '--models-num', default=20, help='benchmark synthetic models number', type=int)
+# fakes state is not shared between processes, so stages are not run by process backend in benchmark
+parser.add_argument('-b', '--backend', default='thread', help='benchmark stages backend, empty to use config',
+                    type=str, choices={'', 'thread'})
+
+parser.add_argument('-t', '--trace', default=None, help='path to task trace file, latest one if not set', type=str)
 
 
 def build(config: dict, args: argparse.Namespace) -> None:
@@ -78,15 +91,43 @@ def build(config: dict, args: argparse.Namespace) -> None:
     config['dockerhub_password'] = dockerhub_password
 
     deployer = Deployer(config)
-    deployer.deploy(models)
+    deployer.deploy(models, resume=args.resume)
+
+
+def benchmark(config: dict, args: argparse.Namespace) -> None:
+    if args.pipeline and args.pipeline not in preset_pipelines.keys():
+        print(f'Unknown pipeline name: {args.pipeline}')
+        return
+
+    if args.model and args.model not in config['models']:
+        print(f'Unknown model full name: {args.model}')
+        return
+
+    pipelines = [args.pipeline] if args.pipeline else None
+    run_benchmark(config, args.models_num, pipelines, args.model, args.backend or None)
+
+
+def summarize(config: dict, args: argparse.Namespace) -> None:
+    trace_path = Path(args.trace) if args.trace else get_latest_trace_path(config['paths']['log_dir'])
+
+    if trace_path is None or not trace_path.is_file():
+        print('Trace file not found')
+        return
+
+    with trace_path.open('r') as f:
+        trace = json.load(f)
+
+    print(f'Trace: {trace_path}')
+    print(summarize_trace(trace))
 
 
 def list_names(config: dict, args: argparse.Namespace) -> None:
     if args.action == 'models':
-        models_info = [f'{model.get("PREFIX", "-")}_'
-                       f'{model.get("MODEL_NAME", "-")} | '
+        # models configs are not rendered for listing
+        models_info = [f'{full_model_name} | '
                        f'{model.get("TEMPLATE", "-")} | '
-                       f'{model.get("CONFIG", "-")}' for model in config['models'].values()]
+                       f'{model.get("CONFIG", "-")}'
+                       for full_model_name, model in config['models'].raw_models.items()]
 
         models_str = '\n'.join(models_info)
         print(models_str)
@@ -112,10 +153,15 @@ def main() -> None:
 
     config = make_config_from_files(config_dir_path,
                                     Path(__file__, '..', '..', '..').resolve(),
-                                    models_config_file_path)
+                                    models_config_file_path,
+                                    Path(__file__, '..').resolve() / '.config_cache/')
 
     if args.action == 'build':
         build(config, args)
+    elif args.action == 'benchmark':
+        benchmark(config, args)
+    elif args.action == 'trace':
+        summarize(config, args)
     else:
         list_names(config, args)
 
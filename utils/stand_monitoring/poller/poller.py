@@ -1,44 +1,231 @@
 import json
 import requests
 import time
+from collections import deque, namedtuple
+from concurrent.futures import Executor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
-from requests.exceptions import ConnectionError, ReadTimeout
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
 from typing import Dict, List, Optional
 
-import polling
-
 OK_RESPONSE = 200
+CONNECTION_RETRY_INTERVAL = 1.0
+QUANTILES = (0.5, 0.95, 0.99)
+
+# error is None for OK response, 'http_<status code>' for other responses or requests exception class name
+ProbeResult = namedtuple('ProbeResult', ['ok', 'latency', 'status_code', 'error'])
 
 config_path = Path(__file__).resolve().parent / 'config.json'
 with open(config_path, 'r') as f_config:
     config = json.load(f_config)
 
+# max number of services probed at once, it is also the size of connections pool per host
+max_concurrency = config['general'].get('max_concurrency', 8)
 
-def probe(services: Dict[str, str], request_timeout: float) -> Dict[str, bool]:
-    probe_result = dict()
+# session is shared by probing threads, so keep-alive connections and TLS sessions are reused between sweeps
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=len(config['services']) + 1, pool_maxsize=max_concurrency)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+
+def get_quantile(sorted_values: List[float], quantile: float) -> float:
+    index = min(int(quantile * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ServicesHealth:
+    """Probe results of services kept in rolling time window, rendered as Prometheus metrics."""
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self.results: Dict[str, deque] = dict()
+        self.last_results: Dict[str, ProbeResult] = dict()
+        # cumulative counters: {service: {error class or 'ok': count}}, {service: [latency sum, probes count]}
+        self.probes_total: Dict[str, Dict[str, int]] = dict()
+        self.latency_total: Dict[str, List[float]] = dict()
+        self.lock = Lock()
+
+    def record(self, service: str, result: ProbeResult) -> None:
+        now = time.time()
+        with self.lock:
+            results = self.results.setdefault(service, deque())
+            results.append((now, result))
+            while results[0][0] < now - self.window:
+                results.popleft()
+            self.last_results[service] = result
+            probes_total = self.probes_total.setdefault(service, dict())
+            probes_total[result.error or 'ok'] = probes_total.get(result.error or 'ok', 0) + 1
+            latency_total = self.latency_total.setdefault(service, [0.0, 0])
+            latency_total[0] += result.latency
+            latency_total[1] += 1
+
+    def get_stats(self, service: str) -> Dict[str, float]:
+        """Returns latency quantiles and error rate of service probes in the window."""
+        with self.lock:
+            results = [result for _, result in self.results.get(service, [])]
+        if not results:
+            return dict()
+        latencies = sorted([result.latency for result in results])
+        stats = {f'p{int(quantile * 100)}': get_quantile(latencies, quantile) for quantile in QUANTILES}
+        stats['error_rate'] = sum([1 for result in results if not result.ok]) / len(results)
+        return stats
+
+    def render_metrics(self) -> str:
+        lines = ['# HELP poller_probe_up Last probe of service returned OK response',
+                 '# TYPE poller_probe_up gauge']
+        with self.lock:
+            services = sorted(self.last_results.keys())
+            last_results = dict(self.last_results)
+            probes_total = {service: dict(counts) for service, counts in self.probes_total.items()}
+            latency_total = {service: list(total) for service, total in self.latency_total.items()}
+        lines += [f'poller_probe_up{{service="{service}"}} {int(last_results[service].ok)}' for service in services]
+
+        lines += ['# HELP poller_probe_status_code HTTP status code of the last probe, 0 if there was no response',
+                  '# TYPE poller_probe_status_code gauge']
+        lines += [f'poller_probe_status_code{{service="{service}"}} {last_results[service].status_code or 0}'
+                  for service in services]
+
+        lines += [f'# HELP poller_probe_latency_seconds Probe latency, quantiles over last {self.window:g}s',
+                  '# TYPE poller_probe_latency_seconds summary']
+        for service in services:
+            stats = self.get_stats(service)
+            lines += [f'poller_probe_latency_seconds{{service="{service}",quantile="{quantile}"}} '
+                      f'{stats[f"p{int(quantile * 100)}"]}' for quantile in QUANTILES]
+            lines.append(f'poller_probe_latency_seconds_sum{{service="{service}"}} {latency_total[service][0]}')
+            lines.append(f'poller_probe_latency_seconds_count{{service="{service}"}} {latency_total[service][1]}')
+
+        lines += [f'# HELP poller_probe_error_rate Share of failed probes over last {self.window:g}s',
+                  '# TYPE poller_probe_error_rate gauge']
+        lines += [f'poller_probe_error_rate{{service="{service}"}} {self.get_stats(service)["error_rate"]}'
+                  for service in services]
+
+        lines += ['# HELP poller_probes_total Probes by result: ok, http_<status code> or exception class',
+                  '# TYPE poller_probes_total counter']
+        for service in services:
+            lines += [f'poller_probes_total{{service="{service}",result="{result}"}} {count}'
+                      for result, count in sorted(probes_total[service].items())]
+
+        return '\n'.join(lines) + '\n'
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve_metrics(health: ServicesHealth, port: int) -> HTTPServer:
+    """Serves services health metrics on /metrics in background thread."""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = health.render_metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+health = ServicesHealth(config['general'].get('stats_window', 600))
+
+
+def probe(services: Dict[str, str], request_timeout: float, executor: Executor) -> Dict[str, bool]:
+    """Probes services concurrently, sweep time is bounded by the longest service deadline."""
+    deadlines = config['general'].get('service_deadlines', {})
+    futures = dict()
 
     for model, url in services.items():
-        service_name = ' '.join([model, url])
-        probe_result[service_name] = custom_post(f'{url}/probe', timeout=request_timeout)
+        futures[model] = executor.submit(timed_post, f'{url}/probe', timeout=deadlines.get(model, request_timeout))
+
+    probe_result = dict()
+    for model, future in futures.items():
+        result = future.result()
+        health.record(model, result)
+        probe_result[' '.join([model, services[model]])] = result.ok
 
     return probe_result
 
 
-def custom_post(url: str, payload: Optional[Dict] = None, timeout: float = None) -> bool:
+def timed_post(url: str, payload: Optional[Dict] = None, timeout: Optional[float] = None) -> ProbeResult:
+    """Posts payload to url, connection errors are retried, other request errors fail probe.
+
+    Timeout is a deadline for all attempts.
+    """
     if payload is None:
         payload = dict()
+    if timeout is None:
+        timeout = config['general']['request_timeout']
     start_time = time.time()
+    deadline = start_time + timeout
     while True:
         try:
-            response = requests.post(url, json=payload, timeout=timeout)
-            return response.status_code is OK_RESPONSE
-        except ReadTimeout:
-            return False
-        except ConnectionError:
-            if time.time() - start_time < timeout:
-                time.sleep(1.0)
+            response = session.post(url, json=payload, timeout=max(deadline - time.time(), 0.001))
+            ok = response.status_code == OK_RESPONSE
+            error = None if ok else f'http_{response.status_code}'
+            return ProbeResult(ok, time.time() - start_time, response.status_code, error)
+        except ConnectionError as e:
+            if deadline - time.time() > CONNECTION_RETRY_INTERVAL:
+                time.sleep(CONNECTION_RETRY_INTERVAL)
             else:
-                return False
+                return ProbeResult(False, time.time() - start_time, None, type(e).__name__)
+        except RequestException as e:
+            # read timeouts, invalid responses and other request errors are not retried
+            return ProbeResult(False, time.time() - start_time, None, type(e).__name__)
+
+
+def custom_post(url: str, payload: Optional[Dict] = None, timeout: Optional[float] = None) -> bool:
+    return timed_post(url, payload, timeout).ok
+
+
+class ServiceSchedule:
+    """Adaptive probing schedule and confirmed status of a service.
+
+    Status is changed only after several consecutive probe results differ from it, so flapping service does not
+    trigger notification on every flip. Probing interval grows exponentially up to max interval while probe results
+    match confirmed status, either up or down, and is reset to min interval when result differs from status.
+    """
+    def __init__(self, status: bool, min_interval: float, max_interval: float, backoff: float,
+                 confirmations: int) -> None:
+        self.status = status
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.confirmations = confirmations
+        self.mismatches = 0
+        self.interval = min_interval
+        self.next_probe_time = time.time() + self.interval
+
+    def update(self, result: bool) -> bool:
+        """Updates schedule with probe result, returns True if confirmed status is changed."""
+        changed = False
+        if result == self.status:
+            self.mismatches = 0
+        else:
+            self.mismatches += 1
+            if self.mismatches >= self.confirmations:
+                self.status = result
+                self.mismatches = 0
+                changed = True
+
+        if result == self.status and not changed:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        else:
+            self.interval = self.min_interval
+
+        self.next_probe_time = time.time() + self.interval
+        return changed
+
 
 # In fact, services_statuses is previous probe_result
 def act(services_status: Dict[str, bool], probe_result: Dict[str, bool]) -> None:
@@ -82,25 +269,41 @@ def notify(services: Dict[str, bool], still_unreachable: List[str] = None, first
 
 
 def start_pooling() -> None:
-    polling_interval = config['general']['polling_interval']
-    request_timeout = config['general']['request_timeout']
+    general_config = config['general']
+    request_timeout = general_config['request_timeout']
     services = config['services']
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    serve_metrics(health, general_config.get('metrics_port', 9101))
 
-    services_status = probe(services, request_timeout)
+    services_status = probe(services, request_timeout, executor)
     notify(services_status, first_notification=True)
 
-    def estimate(prob: Dict[str, bool]) -> bool:
-        return services_status != prob
+    service_models = {' '.join([model, url]): model for model, url in services.items()}
+    schedules = {service_name: ServiceSchedule(status,
+                                               general_config.get('min_polling_interval', 5),
+                                               general_config['polling_interval'],
+                                               general_config.get('polling_backoff', 2),
+                                               general_config.get('status_confirmations', 3))
+                 for service_name, status in services_status.items()}
 
     while True:
-        probe_result = polling.poll(
-            lambda: probe(services, request_timeout),
-            check_success=estimate,
-            step=polling_interval,
-            poll_forever=True)
-
-        act(services_status, probe_result)
-        services_status = probe_result
+        now = time.time()
+        due_services = [service_name for service_name, schedule in schedules.items()
+                        if schedule.next_probe_time <= now]
+
+        if not due_services:
+            time.sleep(min([schedule.next_probe_time for schedule in schedules.values()]) - now)
+            continue
+
+        due_models = [service_models[service_name] for service_name in due_services]
+        probe_result = probe({model: services[model] for model in due_models}, request_timeout, executor)
+
+        for service_name, result in probe_result.items():
+            schedules[service_name].update(result)
+
+        confirmed_status = {service_name: schedule.status for service_name, schedule in schedules.items()}
+        act(services_status, confirmed_status)
+        services_status = confirmed_status
 
 
 if __name__ == '__main__':